@@ -0,0 +1,148 @@
+import argparse
+import glob
+import json
+import os
+import traceback
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from timeit import default_timer
+
+from interpreter import cache_rules, get_worker_interpreter, init_worker
+from output import MemorySink
+from error import CodeError, format_error
+from tokens import RULES_FILE
+
+
+def run_script(code_file):
+    """
+    Runs one script in a worker, capturing everything it outputs.
+
+    Parameters:
+        code_file (str): the path to the script
+
+    Returns:
+        result (dict): "file", "success", "output", "error" (the displayed
+        error, or a traceback for a crash), "error_code" and "time"
+    """
+
+    sink = MemorySink()
+    error = ""
+    error_code = None
+    start_time = default_timer()
+    try:
+        get_worker_interpreter().run_file(code_file, output_sink=sink)
+        success = True
+    except CodeError as e:
+        success = False
+        error_code = e.error_code
+        error = format_error(e)
+    except Exception:
+        success = False
+        error = traceback.format_exc()
+    end_time = default_timer()
+
+    return {
+        "file": code_file,
+        "success": success,
+        "output": sink.getvalue(),
+        "error": error,
+        "error_code": error_code,
+        "time": end_time - start_time,
+    }
+
+
+def find_scripts(patterns):
+    code_files = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True))
+        code_files.extend(matches if matches else [pattern])
+    return code_files
+
+
+def run_batch(code_files, workers=None, rules_file=RULES_FILE):
+    """
+    Runs many scripts in parallel, each in a fresh interpreter state.
+
+    Parameters:
+        code_files (list): the paths of the scripts to run
+        workers (int): the number of worker processes, the number of CPUs if None
+        rules_file (str): the rules file to tokenise with
+
+    Returns:
+        results (list): the result from `run_script` for each script, in order
+    """
+
+    cache_rules(rules_file)
+
+    workers = workers or os.cpu_count() or 1
+    chunk_size = max(1, len(code_files) // (workers * 4))
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=init_worker, initargs=(rules_file,)
+    ) as executor:
+        return list(executor.map(run_script, code_files, chunksize=chunk_size))
+
+
+def summarise(results, wall_time):
+    lines = []
+    for result in results:
+        if result["success"]:
+            status = "ok"
+        elif result["error_code"] is not None:
+            status = f"E{result['error_code']}"
+        else:
+            status = "crash"
+        lines.append(f"{status:>6} {result['time'] * 1000:10.3f} ms  {result['file']}")
+
+    num_succeeded = sum(result["success"] for result in results)
+    error_codes = Counter(
+        result["error_code"] for result in results if result["error_code"] is not None
+    )
+    num_crashed = len(results) - num_succeeded - sum(error_codes.values())
+    total_time = sum(result["time"] for result in results)
+
+    lines.append("")
+    lines.append(f"{num_succeeded}/{len(results)} scripts succeeded")
+    for error_code, count in sorted(error_codes.items()):
+        lines.append(f"  error code {error_code}: {count}")
+    if num_crashed:
+        lines.append(f"  crashed: {num_crashed}")
+    lines.append(
+        f"{total_time:.3f} s of script time in {wall_time:.3f} s "
+        f"({total_time / wall_time if wall_time else 0:.2f}x)"
+    )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run many Prisma scripts in parallel.")
+    parser.add_argument("scripts", nargs="+", help="script paths or glob patterns")
+    parser.add_argument("-j", "--workers", type=int, help="number of worker processes")
+    parser.add_argument("--rules", default=RULES_FILE, help="the rules file")
+    parser.add_argument(
+        "--show-output", action="store_true", help="print each script's output"
+    )
+    parser.add_argument("--json", help="write every result to this JSON file")
+    args = parser.parse_args()
+
+    code_files = find_scripts(args.scripts)
+
+    start_time = default_timer()
+    results = run_batch(code_files, args.workers, args.rules)
+    wall_time = default_timer() - start_time
+
+    if args.show_output:
+        for result in results:
+            print(f"==> {result['file']} <==")
+            print(result["output"] + result["error"], end="")
+
+    print(summarise(results, wall_time))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(
+                {"wall_time": wall_time, "results": results}, file, indent=4
+            )
+
+
+if __name__ == "__main__":
+    main()
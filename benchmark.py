@@ -0,0 +1,203 @@
+import argparse
+import json
+import math
+import os
+import tempfile
+from timeit import default_timer
+
+from interpreter import Interpreter
+from output import MemorySink
+from lex import tokenise
+from tokens import RULES_FILE
+
+
+def variable_name(number):
+    # Variable names can only contain letters
+    return "v" + "".join(chr(ord("a") + int(digit)) for digit in str(number))
+
+
+# Each generator makes a program whose work grows with size
+def long_file(size):
+    statements = []
+    for i in range(size):
+        statements.append(f"set v = {i} * 2 + 1;")
+        statements.append(f"output(v - {i});")
+    return "\n".join(statements) + "\n"
+
+
+def long_strings(size):
+    text = "lorem ipsum dolor sit amet " * (size // 27 + 1)
+    return (
+        f"# {text[:size]}\n"
+        f"set s = \"{text[:size]}\";\n"
+        f"output('{text[:size]}');\n"
+        f"output(s);\n"
+    )
+
+
+def nested_loops(size, depth=8):
+    # depth levels of loops, alternating repeat and while, each running twice,
+    # around an innermost loop that runs size times
+    lines = []
+    for level in range(depth):
+        indent = "    " * level
+        if level % 2 == 0:
+            lines.append(f"{indent}repeat (2) {{")
+        else:
+            name = variable_name(level)
+            lines.append(f"{indent}set {name} = 0;")
+            lines.append(f"{indent}while ({name} < 2) {{")
+            lines.append(f"{indent}    set {name} = {name} + 1;")
+    indent = "    " * depth
+    lines.append(f"{indent}repeat ({size}) {{ set total = total + 1; }}")
+    for level in reversed(range(depth)):
+        lines.append("    " * level + "}")
+    return "set total = 0;\n" + "\n".join(lines) + "\noutput(total);\n"
+
+
+def long_expression(size):
+    terms = " + ".join(f"(x * {i % 7 + 1} - {i % 5})" for i in range(size))
+    return f"set x = 3;\nrepeat (100) {{ set y = {terms}; }}\noutput(y);\n"
+
+
+def output_heavy(size):
+    return f"set i = 0;\nrepeat ({size}) {{ set i = i + 1; output(i); }}\n"
+
+
+def many_variables(size):
+    names = [variable_name(i) for i in range(size)]
+    sets = "\n".join(f"set {name} = {i};" for i, name in enumerate(names))
+    return f"{sets}\nset total = {' + '.join(names)};\noutput(total);\n"
+
+
+WORKLOADS = {
+    "long_file": (long_file, [1000, 2000, 4000, 8000]),
+    "long_strings": (long_strings, [10000, 20000, 40000, 80000]),
+    "nested_loops": (nested_loops, [100, 200, 400, 800]),
+    "long_expression": (long_expression, [50, 100, 200, 400]),
+    "output_heavy": (output_heavy, [10000, 20000, 40000, 80000]),
+    "many_variables": (many_variables, [250, 500, 1000, 2000]),
+}
+
+
+def best_time(function, repeat):
+    # The fastest of several runs is the least affected by other processes
+    times = []
+    for _ in range(repeat):
+        start_time = default_timer()
+        function()
+        times.append(default_timer() - start_time)
+    return min(times)
+
+
+def run_workload(interpreter, name, sizes, repeat, directory):
+    """
+    Times tokenising and running a workload at each of its sizes.
+
+    Parameters:
+        interpreter (Interpreter): the interpreter to run the programs with
+        name (str): the name of the workload in WORKLOADS
+        sizes (list): the sizes to generate the workload at
+        repeat (int): the number of times to run each measurement
+        directory (str): where to write the generated programs
+
+    Returns:
+        results (list): a dict for each size, with "size", "characters",
+        "tokens", "lex_time" and "run_time", and "lex_scaling" and
+        "run_scaling" (how the time grows with size, 1 is linear)
+    """
+
+    generator = WORKLOADS[name][0]
+    results = []
+    for size in sizes:
+        code = generator(size)
+        code_file = os.path.join(directory, f"{name}_{size}.prsm")
+        with open(code_file, "w", encoding="utf-8") as file:
+            file.write(code)
+
+        # Run once first, so the timed runs don't include warming up
+        program_tokens = tokenise(interpreter.rules_file, code_file)
+        interpreter.run_file(code_file, output_sink=MemorySink())
+
+        lex_time = best_time(
+            lambda: tokenise(interpreter.rules_file, code_file), repeat
+        )
+        run_time = best_time(
+            lambda: interpreter.run_file(code_file, output_sink=MemorySink()), repeat
+        )
+        results.append(
+            {
+                "size": size,
+                "characters": len(code),
+                "tokens": len(program_tokens),
+                "lex_time": lex_time,
+                "run_time": run_time,
+                "lex_scaling": None,
+                "run_scaling": None,
+            }
+        )
+
+    for previous, result in zip(results, results[1:]):
+        size_ratio = math.log(result["size"] / previous["size"])
+        for phase in ("lex", "run"):
+            if previous[f"{phase}_time"] > 0 and result[f"{phase}_time"] > 0:
+                result[f"{phase}_scaling"] = (
+                    math.log(result[f"{phase}_time"] / previous[f"{phase}_time"])
+                    / size_ratio
+                )
+
+    return results
+
+
+def format_scaling(scaling):
+    return "" if scaling is None else f"x^{scaling:.2f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time the lexer and interpreter on generated Prisma programs."
+    )
+    parser.add_argument(
+        "workloads",
+        nargs="*",
+        help=f"the workloads to run, all of them if none are given: {', '.join(WORKLOADS)}",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="runs per measurement, the best is kept"
+    )
+    parser.add_argument(
+        "--scale", type=float, default=1, help="multiply every size by this"
+    )
+    parser.add_argument("--rules", default=RULES_FILE, help="the rules file")
+    parser.add_argument("--json", help="write the results to this JSON file")
+    args = parser.parse_args()
+    for name in args.workloads:
+        if name not in WORKLOADS:
+            parser.error(f"unknown workload '{name}'")
+
+    interpreter = Interpreter(args.rules)
+    all_results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name in args.workloads or WORKLOADS:
+            sizes = [max(1, round(size * args.scale)) for size in WORKLOADS[name][1]]
+            results = run_workload(interpreter, name, sizes, args.repeat, directory)
+            all_results[name] = results
+
+            print(name)
+            print(
+                f"  {'size':>8} {'tokens':>8} {'lex ms':>10} {'':>7} {'run ms':>10} {'':>7}"
+            )
+            for result in results:
+                print(
+                    f"  {result['size']:>8} {result['tokens']:>8} "
+                    f"{result['lex_time'] * 1000:>10.2f} {format_scaling(result['lex_scaling']):>7} "
+                    f"{result['run_time'] * 1000:>10.2f} {format_scaling(result['run_scaling']):>7}"
+                )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(all_results, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
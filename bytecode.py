@@ -0,0 +1,440 @@
+import operator
+from tokens import *
+from helper import infix_to_postfix, literal_value
+from error import CodeError
+
+# Opcodes. Each instruction is an (opcode, argument) tuple. While an
+# expression is compiled, instructions that can fail also carry the token to
+# blame, as an (opcode, argument, token) tuple.
+LOAD_CONST = 0  # argument: the value to push
+LOAD_VARIABLE = 1  # argument: the slot of a variable that is always defined here
+LOAD_OPERAND = 2  # argument: the slot of a variable that is always defined here, can't be a STRING
+STORE_VARIABLE = 3  # argument: the slot to store in
+BINARY = 4  # argument: the function to call on the top two values
+JUMP = 5  # argument: the instruction to jump to
+JUMP_IF_FALSE = 6  # argument: the instruction to jump to
+REPEAT_SETUP = 7  # turns the value on top of the stack into a repeat counter
+REPEAT_NEXT = 8  # argument: the instruction to jump to once the counter runs out
+OUTPUT = 9
+RAISE = 10  # argument: the exception to raise
+LOAD_VARIABLE_CHECKED = 11  # like LOAD_VARIABLE, but the variable might not be defined
+LOAD_OPERAND_CHECKED = 12  # like LOAD_OPERAND, but the variable might not be defined
+COUNT = 13  # argument: the counter to add one to, only compiled in when counting
+PROFILE = 14  # argument: the profile site that starts here, only compiled in when profiling
+
+# Counters for COUNT
+COUNT_STATEMENTS = 0
+COUNT_EXPRESSIONS = 1
+COUNT_LOOP_ITERATIONS = 2
+COUNTER_NAMES = ["statements_executed", "expression_evaluations", "loop_iterations"]
+
+LOAD_OPCODES = {LOAD_VARIABLE, LOAD_OPERAND, LOAD_VARIABLE_CHECKED, LOAD_OPERAND_CHECKED}
+
+OPCODE_NAMES = [
+    "LOAD_CONST",
+    "LOAD_VARIABLE",
+    "LOAD_OPERAND",
+    "STORE_VARIABLE",
+    "BINARY",
+    "JUMP",
+    "JUMP_IF_FALSE",
+    "REPEAT_SETUP",
+    "REPEAT_NEXT",
+    "OUTPUT",
+    "RAISE",
+    "LOAD_VARIABLE_CHECKED",
+    "LOAD_OPERAND_CHECKED",
+    "COUNT",
+    "PROFILE",
+]
+
+
+def as_boolean(value):
+    # and/or give a BOOLEAN, so 0 and 1 are shown as false and true
+    if value == 0 or value == 1:
+        return bool(value)
+    return value
+
+
+def logical_and(a, b):
+    return as_boolean(a and b)
+
+
+def logical_or(a, b):
+    return as_boolean(a or b)
+
+
+BINARY_OPERATIONS = {
+    OPERATION_PLUS: operator.add,
+    OPERATION_MINUS: operator.sub,
+    OPERATION_TIMES: operator.mul,
+    OPERATION_DIVIDE: operator.truediv,
+    OPERATION_MODULO: operator.mod,
+    OPERATION_POWER: operator.pow,
+    OPERATION_LESS_THAN: operator.lt,
+    OPERATION_GREATER_THAN: operator.gt,
+    OPERATION_EQUAL_TO: operator.eq,
+    OPERATION_LESS_EQUAL: operator.le,
+    OPERATION_GREATER_EQUAL: operator.ge,
+    OPERATION_NOT_EQUAL: operator.ne,
+    OPERATION_AND: logical_and,
+    OPERATION_OR: logical_or,
+}
+
+
+MAX_FOLDED_POWER_BITS = 4096  # Bigger powers are left until they run
+
+
+def is_small_power(base, exponent):
+    # Integer powers can be huge and slow to work out, and the expression
+    # might never run, so only fold them if the result is small
+    if type(base) is not int or type(exponent) is not int:
+        # Float powers overflow instead of growing
+        return True
+    if exponent <= 1 or abs(base) <= 1:
+        return True
+    return abs(base).bit_length() * exponent <= MAX_FOLDED_POWER_BITS
+
+
+def fold_constants(instructions):
+    """
+    Evaluates every operation in an expression whose operands are both constants.
+
+    Parameters:
+        instructions (list): the instructions for one expression
+
+    Returns:
+        instructions (list): the instructions with the constant operations
+        replaced by their results
+        num_folded (int): the number of operations that were folded
+    """
+
+    folded = []
+    num_folded = 0
+    for instruction in instructions:
+        opcode, argument = instruction[:2]
+        if (
+            opcode == BINARY
+            and len(folded) >= 2
+            and folded[-1][0] == LOAD_CONST
+            and folded[-2][0] == LOAD_CONST
+            and (
+                argument is not operator.pow
+                or is_small_power(folded[-2][1], folded[-1][1])
+            )
+        ):
+            try:
+                value = argument(folded[-2][1], folded[-1][1])
+            except Exception:
+                # Leave errors such as dividing by zero for when it runs
+                folded.append(instruction)
+                continue
+
+            folded[-2:] = [(LOAD_CONST, value)]
+            num_folded += 1
+        else:
+            folded.append(instruction)
+
+    return folded, num_folded
+
+
+def get_slot(program, name):
+    slots = program["slots"]
+    try:
+        return slots[name]
+    except KeyError:
+        slots[name] = len(slots)
+        return slots[name]
+
+
+def compile_load(program, token, is_operand, defined, maybe_defined):
+    # A variable that might not be set yet is checked when it is read, so
+    # reading it is only an error if the read runs
+    name = token.content
+    if name not in maybe_defined:
+        # No statement that could have set it can run before this, so the
+        # read fails if it runs, but it might never run
+        program["warnings"].append(
+            {
+                "message": f"Variable '{name}' is not defined",
+                "error_code": 2002,
+                "token": token,
+            }
+        )
+
+    if name in defined:
+        opcode = LOAD_OPERAND if is_operand else LOAD_VARIABLE
+    else:
+        opcode = LOAD_OPERAND_CHECKED if is_operand else LOAD_VARIABLE_CHECKED
+
+    return (opcode, get_slot(program, name), token)
+
+
+def compile_count(program, counter):
+    if program["counters"] is not None:
+        program["code"].append((COUNT, counter))
+
+
+def compile_profile(program, kind, token, stack):
+    # Everything run from here to the next PROFILE is timed against this site
+    # Returns the site, and the stack for the statements inside it
+    profile = program["profile"]
+    if profile is None:
+        return None, stack
+
+    site = len(profile["sites"])
+    stack = stack + (f"{token.subclass} line {token.line_number}",)
+    profile["sites"].append(
+        {"kind": kind, "line_number": token.line_number, "stack": stack}
+    )
+    profile["hits"].append(0)
+    profile["times"].append(0.0)
+    program["code"].append((PROFILE, site))
+    return site, stack
+
+
+def check_expression(expression):
+    # Values and operations have to take turns, starting and ending with a
+    # value, so every operation has a value on both sides and the expression
+    # leaves exactly one value on the stack
+    expecting_value = True
+    previous_token = None
+    for token in expression["tokens"]:
+        kind = token.kind
+        if kind == DELIMITER_LPAREN or kind == DELIMITER_RPAREN:
+            continue
+
+        is_operation = kind in OPERATION_KINDS
+        if expecting_value and is_operation:
+            raise CodeError(
+                f"Expected a value before '{token.content}'",
+                error_code=1006,
+                error_token=token,
+            )
+        if not expecting_value and not is_operation:
+            raise CodeError(
+                f"Expected an operation before '{token.content}'",
+                error_code=1006,
+                error_token=token,
+            )
+        expecting_value = is_operation
+        previous_token = token
+
+    if previous_token is None:
+        raise CodeError(
+            "Expected expression", error_code=1006, error_token=expression["tokens"][0]
+        )
+    if expecting_value:
+        raise CodeError(
+            f"Expected a value after '{previous_token.content}'",
+            error_code=1006,
+            error_token=previous_token,
+        )
+
+
+def compile_expression(program, expression, defined, maybe_defined):
+    code = program["code"]
+    compile_count(program, COUNT_EXPRESSIONS)
+    tokens = expression["tokens"]
+    if len(tokens) == 1 and tokens[0].kind == LITERAL_STRING:
+        code.append((LOAD_CONST, literal_value(tokens[0])))
+        return
+
+    try:
+        postfix = infix_to_postfix(tokens)
+        check_expression(expression)
+    except CodeError as e:
+        # Only raised if the expression is reached, like any other runtime error
+        code.append((RAISE, e))
+        return
+
+    instructions = []
+    for token in postfix:
+        if token.kind == IDENTIFIER_VARIABLE:
+            instructions.append(
+                compile_load(program, token, len(postfix) > 1, defined, maybe_defined)
+            )
+        elif token.kind in OPERATION_KINDS:
+            instructions.append((BINARY, BINARY_OPERATIONS[token.kind], token))
+        else:
+            instructions.append((LOAD_CONST, literal_value(token)))
+
+    instructions, num_folded = fold_constants(instructions)
+    program["num_folded"] += num_folded
+
+    for opcode, argument, *error_token in instructions:
+        if error_token:
+            # Keep the token out of the instruction, it's only needed for errors
+            program["error_tokens"][len(code)] = error_token[0]
+        code.append((opcode, argument))
+
+
+def assigned_variables(statements):
+    names = set()
+    for statement in statements:
+        if statement["type"] == "SET":
+            names.add(statement["variable"].content)
+        elif "body" in statement:
+            names |= assigned_variables(statement["body"])
+    return names
+
+
+def compile_statements(program, statements, defined, maybe_defined, stack=()):
+    # defined: variables that are set whichever way the program got here
+    # maybe_defined: variables that could have been set by the time it gets here
+    # stack: the loops the statements are in, for profiling
+    code = program["code"]
+    for statement in statements:
+        statement_type = statement["type"]
+        if statement_type != "WHILE":
+            # A WHILE is profiled from its condition, which runs every time round
+            site, loop_stack = compile_profile(
+                program, statement_type, statement["token"], stack
+            )
+        compile_count(program, COUNT_STATEMENTS)
+
+        if statement_type == "OUTPUT":
+            compile_expression(
+                program, statement["parameters"][0], defined, maybe_defined
+            )
+            code.append((OUTPUT, None))
+
+        elif statement_type == "SET":
+            compile_expression(program, statement["expression"], defined, maybe_defined)
+            name = statement["variable"].content
+            code.append((STORE_VARIABLE, get_slot(program, name)))
+            defined.add(name)
+            maybe_defined.add(name)
+
+        elif statement_type in ("REPEAT", "WHILE"):
+            # The body may run any number of times, including none, so what it
+            # sets isn't defined for certain, either inside the loop or after
+            # it, but it might be
+            loop_maybe_defined = maybe_defined | assigned_variables(statement["body"])
+
+            if statement_type == "REPEAT":
+                compile_expression(
+                    program, statement["parameter"], defined, maybe_defined
+                )
+                program["error_tokens"][len(code)] = statement["token"]
+                code.append((REPEAT_SETUP, None))
+                loop_start = len(code)
+                if site is not None:
+                    # Checking the counter each time round belongs to the REPEAT too
+                    code.append((PROFILE, site))
+                repeat_next = len(code)
+                code.append(None)  # Filled in once the end of the loop is known
+                compile_count(program, COUNT_LOOP_ITERATIONS)
+                compile_statements(
+                    program,
+                    statement["body"],
+                    set(defined),
+                    loop_maybe_defined,
+                    loop_stack,
+                )
+                code.append((JUMP, loop_start))
+                code[repeat_next] = (REPEAT_NEXT, len(code))
+            else:
+                loop_start = len(code)
+                site, loop_stack = compile_profile(
+                    program, "WHILE condition", statement["token"], stack
+                )
+                compile_expression(
+                    program, statement["parameter"], defined, loop_maybe_defined
+                )
+                condition_jump = len(code)
+                code.append(None)  # Filled in once the end of the loop is known
+                compile_count(program, COUNT_LOOP_ITERATIONS)
+                compile_statements(
+                    program,
+                    statement["body"],
+                    set(defined),
+                    loop_maybe_defined,
+                    loop_stack,
+                )
+                code.append((JUMP, loop_start))
+                code[condition_jump] = (JUMP_IF_FALSE, len(code))
+
+            maybe_defined |= loop_maybe_defined
+
+
+def compile_program(statements, slots=None, defined=(), count=False, profile=False):
+    """
+    Compiles parsed statements into instructions for vm.run_bytecode.
+
+    Loops are compiled into jumps. A REPEAT keeps its counter on the stack
+    while its body runs, which is safe because every statement leaves the
+    stack as it found it. Operations on constants are folded at compile time.
+
+    Variables are resolved to slots in a frame. A variable that is always
+    set before it is read is loaded without checking it is defined. Any
+    other variable is checked when it is read, so reading one that isn't
+    set is only an error if the read runs. A read of a variable that no
+    earlier statement could have set, on any path, fails whenever it runs,
+    so it is also recorded as a warning in the program's "warnings".
+
+    If count is True, COUNT instructions are compiled in to count the
+    statements, expressions and loop iterations run. Otherwise there are
+    none, so counting costs nothing when it isn't used.
+
+    If profile is True, PROFILE instructions are compiled in at the start of
+    every statement and every time a loop goes round, so the time spent and
+    the number of times each one runs can be recorded in the program's
+    "profile". Like counting, profiling costs nothing when it isn't used.
+
+    Parameters:
+        statements (list): the statements from parse.parse_tokens
+        slots (dict): the slot for each variable name, added to as new names
+        are found
+        defined (iterable): the names of variables that are already set, from
+        earlier programs using the same slots
+        count (bool): whether to count what runs, in the program's "counters"
+        profile (bool): whether to time each statement, in the program's "profile"
+
+    Returns:
+        program (dict): the program, with "code" (the (opcode, argument)
+        instructions), "slots", "error_tokens" (the token for each
+        instruction that can raise a CodeError), "num_folded" (the number of
+        operations that were folded), "warnings" (a dict with the "message",
+        "error_code" and "token" of each read of a variable that can't be
+        set), "counters" (a count for each of
+        COUNTER_NAMES, or None if not counting) and "profile" (None if not
+        profiling, otherwise "sites", each with the "kind", "line_number" and
+        "stack" of loops of a statement, and the "hits" and "times" of each site)
+    """
+
+    program = {
+        "code": [],
+        "slots": {} if slots is None else slots,
+        "error_tokens": {},
+        "num_folded": 0,
+        "warnings": [],
+        "counters": [0] * len(COUNTER_NAMES) if count else None,
+        "profile": {"sites": [], "hits": [], "times": []} if profile else None,
+    }
+    compile_statements(program, statements, set(defined), set(defined))
+    return program
+
+
+def disassemble(program):
+    names = {slot: name for name, slot in program["slots"].items()}
+    lines = []
+    for i, (opcode, argument) in enumerate(program["code"]):
+        if opcode == BINARY:
+            argument = argument.__name__
+        elif opcode == LOAD_CONST:
+            argument = repr(argument)
+        elif opcode in LOAD_OPCODES or opcode == STORE_VARIABLE:
+            argument = f"{argument} ({names[argument]})"
+        elif opcode == COUNT:
+            argument = COUNTER_NAMES[argument]
+        elif opcode == PROFILE:
+            site = program["profile"]["sites"][argument]
+            argument = f"{site['kind']} line {site['line_number']}"
+        lines.append(f"{i:>4} {OPCODE_NAMES[opcode]:<22}{'' if argument is None else argument}")
+    for warning in program["warnings"]:
+        token = warning["token"]
+        lines.append(
+            f"WARNING line {token.line_number}: {warning['message']} (code {warning['error_code']})"
+        )
+    return "\n".join(lines)
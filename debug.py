@@ -3,6 +3,11 @@ DEBUG_SHOW_ERROR_TOKEN = False
 DEBUG_SHOW_VARIABLES_AT_END = False
 DEBUG_SHOW_RAW_ERROR = False
 DEBUG_SHOW_TIME_TAKEN = False
+DEBUG_SHOW_BYTECODE = False
+DEBUG_SHOW_CONSTANT_FOLDING = False
+DEBUG_METRICS_FILE = None  # Path to write performance metrics to as JSON
+DEBUG_SHOW_PROFILE = False  # Show the time spent on each line
+DEBUG_PROFILE_FILE = None  # Path to write the profile to as collapsed stacks, for flamegraphs
 
 if DEBUG_ONLY_TOKENS:
     print("\033[33mDEBUG_ONLY_TOKENS ACTIVE\033[0m")
@@ -13,4 +18,14 @@ if DEBUG_SHOW_VARIABLES_AT_END:
 if DEBUG_SHOW_RAW_ERROR:
     print("\033[33mDEBUG_SHOW_RAW_ERROR ACTIVE\033[0m")
 if DEBUG_SHOW_TIME_TAKEN:
-    print("\033[33mDEBUG_SHOW_TIME_TAKEN ACTIVE\033[0m")
\ No newline at end of file
+    print("\033[33mDEBUG_SHOW_TIME_TAKEN ACTIVE\033[0m")
+if DEBUG_SHOW_BYTECODE:
+    print("\033[33mDEBUG_SHOW_BYTECODE ACTIVE\033[0m")
+if DEBUG_SHOW_CONSTANT_FOLDING:
+    print("\033[33mDEBUG_SHOW_CONSTANT_FOLDING ACTIVE\033[0m")
+if DEBUG_METRICS_FILE:
+    print(f"\033[33mDEBUG_METRICS_FILE ACTIVE ({DEBUG_METRICS_FILE})\033[0m")
+if DEBUG_SHOW_PROFILE:
+    print("\033[33mDEBUG_SHOW_PROFILE ACTIVE\033[0m")
+if DEBUG_PROFILE_FILE:
+    print(f"\033[33mDEBUG_PROFILE_FILE ACTIVE ({DEBUG_PROFILE_FILE})\033[0m")
\ No newline at end of file
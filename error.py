@@ -1,3 +1,7 @@
+import io
+from contextlib import redirect_stdout
+from functools import cached_property
+from lex import find_end_token, find_start_token
 from debug import *
 from helper import *
 from tokens import *
@@ -23,48 +27,118 @@ class CodeError(Exception):
         end_position=None,
     ):
         super().__init__(message)
+
         self.error_code = error_code
-        self.token = error_token or get_current_token()
-        self.start_position = start_position or self.token["start_position"]
-        self.end_position = end_position or self.token["end_position"]
-        self.line_number = self.token["line_number"]
-        self.line_position = line_start_positions[self.line_number - 1]
-        self.line = lines[self.line_number - 1]
-        self.relative_start_position = self.start_position - self.line_position
-        self.relative_end_position = self.end_position - self.line_position
-        self.start_token = [
-            t for t in tokens if t["start_position"] <= self.start_position
-        ][-1]
-        self.end_token = [t for t in tokens if t["end_position"] >= self.end_position][
-            0
-        ]
-        self.lines = lines[
-            self.start_token["line_number"] - 1 : self.end_token["line_number"]
+        self.token = None
+        self.start_position = start_position
+        self.end_position = end_position
+        self.line_number = None
+        if error_token is not None:
+            self.set_token(error_token)
+
+        # Added by whatever ran the code, with add_context
+        self.code_file = None
+        self.tokens = []
+        self.loaded_source_index = None
+
+    def set_token(self, token):
+        self.token = token
+        self.start_position = self.start_position or token.start_position
+        self.end_position = self.end_position or token.end_position
+        self.line_number = token.line_number
+
+    def add_context(self, code_file, tokens, source_index):
+        """
+        Records where the error came from, so it can be displayed. Only what
+        is needed to find the context is kept here, the context itself is
+        worked out if the error is displayed. An error without a token is
+        blamed on the first token of the statement.
+
+        Parameters:
+            code_file (str): the name of the file the code came from
+            tokens (list): the tokens of the statement the error came from
+            source_index (SourceIndex): the index of the code, or None if it
+            was streamed and has to be read again
+        """
+
+        self.code_file = code_file
+        self.tokens = tokens
+        self.loaded_source_index = source_index
+        if self.token is None and tokens:
+            self.set_token(tokens[0])
+
+    @cached_property
+    def source_index(self):
+        if self.loaded_source_index is None:
+            # The code was streamed, so it has to be read now
+            return read_source_index(self.code_file)
+        return self.loaded_source_index
+
+    @cached_property
+    def line_position(self):
+        return self.source_index.line_start_position(self.line_number)
+
+    @cached_property
+    def line(self):
+        return self.source_index.lines[self.line_number - 1]
+
+    @property
+    def relative_start_position(self):
+        return self.start_position - self.line_position
+
+    @property
+    def relative_end_position(self):
+        return self.end_position - self.line_position
+
+    @cached_property
+    def start_token(self):
+        return find_start_token(self.tokens, self.start_position)
+
+    @cached_property
+    def end_token(self):
+        return find_end_token(self.tokens, self.end_position)
+
+    @cached_property
+    def lines(self):
+        return self.source_index.lines[
+            self.start_token.line_number - 1 : self.end_token.line_number
         ]
 
 
+def format_error(e):
+    # What display_error would show, to send somewhere other than stdout
+    error_output = io.StringIO()
+    with redirect_stdout(error_output):
+        display_error(e)
+    return error_output.getvalue()
+
+
 def display_error(e):
     error_line_numbers = range(
-        e.start_token["line_number"], e.end_token["line_number"] + 1
+        e.start_token.line_number, e.end_token.line_number + 1
     )
     line_number_digits = len(str(error_line_numbers[-1]))
     max_line_width = max(len(line) for line in e.lines)
     display_lines = [line.ljust(max_line_width) for line in e.lines]
 
     if e.token:
-        underline_start_position = e.token["start_position"]
-        underline_end_position = e.token["end_position"]
+        underline_start_position = e.token.start_position
+        underline_end_position = e.token.end_position
     else:
         underline_start_position = e.start_position
         underline_end_position = e.end_position
 
-    underline_start_line_number = find_line_number(underline_start_position)
-    underline_end_line_number = find_line_number(underline_end_position)
+    source_index = e.source_index
+    underline_start_line_number = source_index.line_number(underline_start_position)
+    underline_end_line_number = source_index.line_number(underline_end_position)
     relative_underline_start_position = (
-        underline_start_position - line_start_positions[underline_start_line_number - 1]
+        underline_start_position
+        - source_index.line_start_position(underline_start_line_number)
     )
     relative_underline_end_position = (
-        underline_end_position - line_start_positions[underline_end_line_number - 1] + 1
+        underline_end_position
+        - source_index.line_start_position(underline_end_line_number)
+        + 1
     )
 
     relative_underline_start_line_number = (
@@ -143,7 +217,7 @@ def display_error(e):
 
     print(f"\033[31mError code {e.error_code}\033[0m")
     print(
-        f"\033[31m{CODE_FILE}:{e.line_number}:{relative_underline_start_position + 1}\033[0m"
+        f"\033[31m{e.code_file}:{e.line_number}:{relative_underline_start_position + 1}\033[0m"
     )
 
     if DEBUG_SHOW_ERROR_TOKEN:
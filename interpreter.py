@@ -0,0 +1,289 @@
+from timeit import default_timer
+from debug import *
+from tokens import *
+from helper import get_variables, plural_s
+from error import CodeError
+from lex import (
+    SourceIndex,
+    group_tokens,
+    load_rules,
+    scan_tokens,
+    tokenise_code,
+    tokenise_stream,
+)
+from parse import parse_tokens
+from bytecode import COUNTER_NAMES, compile_program, disassemble
+from vm import run_bytecode
+from output import flush_output, set_output_sink
+from profiler import add_program_profile, new_profile
+
+worker_interpreter = None  # The interpreter of this worker, made by init_worker
+
+
+class Interpreter:
+    """
+    Runs Prisma programs. The rules are loaded once, when the interpreter is
+    made, and every run starts with no variables, so one interpreter can run
+    any number of programs one after another.
+
+    Attributes:
+        rules_file (str): the rules file used to tokenise programs
+        collect_metrics (bool): whether to time each phase of every run
+        collect_profile (bool): whether to time each statement of every run
+        slots (dict): the slot of each variable in the last program run
+        frame (list): the value of each slot in the last program run
+        metrics (dict): the metrics for the last program run, or None if
+        they aren't being collected
+        profile (dict): the profile of the last program run, for the
+        profiler module, or None if it isn't being collected
+        code_file (str): the name of the last program run, for errors
+        source_index (SourceIndex): the index of the last program run, or
+        None if it was streamed and hasn't been read since
+        tokens (list): the tokens of the statement being run, for errors
+    """
+
+    def __init__(self, rules_file=RULES_FILE, collect_metrics=False, collect_profile=False):
+        self.rules_file = rules_file
+        self.collect_metrics = collect_metrics
+        self.collect_profile = collect_profile
+        self.rule_tables = load_rules(rules_file)
+        self.slots = {}
+        self.frame = []
+        self.metrics = None
+        self.profile = None
+        self.code_file = None
+        self.source_index = None
+        self.tokens = []
+
+    def new_metrics(self, code_file):
+        return {
+            "code_file": code_file,
+            "rules_load_time": self.rule_tables.get("load_time"),
+            "lex_time": 0.0,
+            "grouping_time": 0.0,
+            "parse_time": 0.0,
+            "compile_time": 0.0,
+            "execute_time": 0.0,
+            "total_time": 0.0,
+            "scanned_tokens": 0,
+            "tokens": 0,
+            "tokens_per_second": None,
+            "instructions": 0,
+            "folded_operations": 0,
+            **{name: 0 for name in COUNTER_NAMES},
+            "error_code": None,
+        }
+
+    def tokenise_measured(self, code):
+        # Scans and groups separately, so each can be timed
+        start_time = default_timer()
+        scanned_tokens = list(
+            scan_tokens(code, self.rule_tables["rules"], self.rule_tables["scanners"])
+        )
+        lex_end_time = default_timer()
+        program_tokens = list(
+            group_tokens(scanned_tokens, self.rule_tables["group_trie"])
+        )
+        end_time = default_timer()
+
+        self.metrics["lex_time"] += lex_end_time - start_time
+        self.metrics["grouping_time"] += end_time - lex_end_time
+        self.metrics["scanned_tokens"] += len(scanned_tokens)
+        return program_tokens
+
+    def measure_stream(self, token_stream):
+        # Streamed tokens are scanned and grouped together, so they are timed together
+        self.metrics["grouping_time"] = None
+        self.metrics["scanned_tokens"] = None
+        token_stream = iter(token_stream)
+        while True:
+            start_time = default_timer()
+            token = next(token_stream, None)
+            self.metrics["lex_time"] += default_timer() - start_time
+            if token is None:
+                return
+            yield token
+
+    def get_variables(self):
+        return get_variables(self.slots, self.frame)
+
+    def get_lines(self):
+        # Streamed code is only read again when it is needed
+        if self.source_index is None:
+            self.source_index = read_source_index(self.code_file)
+        return self.source_index.lines
+
+    def run_source(self, code, code_file="<source>", output_sink=None):
+        """
+        Runs a program from a string.
+
+        Parameters:
+            code (str): the program
+            code_file (str): the name to show in error messages
+            output_sink: where output goes, instead of the current output sink
+
+        Returns:
+            variables (dict): the value of each variable at the end
+
+        Raises:
+            CodeError: if the program has an error
+        """
+
+        self.code_file = code_file
+        self.source_index = SourceIndex(code)
+        if self.collect_metrics:
+            self.metrics = self.new_metrics(code_file)
+            program_tokens = self.tokenise_measured(code)
+        else:
+            program_tokens = tokenise_code(
+                self.rules_file, code, rule_tables=self.rule_tables
+            )
+        return self.run_statements([program_tokens], output_sink)
+
+    def run_file(self, code_file, stream=False, output_sink=None):
+        """
+        Runs a program from a file.
+
+        Parameters:
+            code_file (str): the path to the program
+            stream (bool): whether to run each statement as soon as it has
+            been tokenised, instead of reading the whole file first
+            output_sink: where output goes, instead of the current output sink
+
+        Returns:
+            variables (dict): the value of each variable at the end
+
+        Raises:
+            CodeError: if the program has an error
+        """
+
+        if not stream:
+            with open(code_file, "r", encoding="utf-8") as file:
+                code = file.read()
+            return self.run_source(code, code_file, output_sink)
+
+        # Lines are only read if there is an error
+        self.code_file = code_file
+        self.source_index = None
+        token_stream = tokenise_stream(
+            self.rules_file, code_file, rule_tables=self.rule_tables
+        )
+        if self.collect_metrics:
+            self.metrics = self.new_metrics(code_file)
+            token_stream = self.measure_stream(token_stream)
+        return self.run_statements(get_statements(token_stream), output_sink)
+
+    def run_statements(self, token_lists, output_sink=None):
+        self.slots = {}
+        self.frame = []
+        self.profile = new_profile() if self.collect_profile else None
+        self.tokens = []
+
+        if output_sink is not None:
+            old_output_sink = set_output_sink(output_sink)
+        try:
+            for statement_tokens in token_lists:
+                self.tokens = statement_tokens
+                self.run_tokens(statement_tokens)
+        except CodeError as e:
+            e.add_context(self.code_file, self.tokens, self.source_index)
+            if self.metrics is not None:
+                self.metrics["error_code"] = e.error_code
+            raise
+        finally:
+            # Write out everything the run output while stdout is still where
+            # the caller expects it
+            if output_sink is not None:
+                set_output_sink(old_output_sink)
+            else:
+                flush_output()
+            if self.metrics is not None:
+                self.finish_metrics()
+
+        return self.get_variables()
+
+    def finish_metrics(self):
+        metrics = self.metrics
+        phases = ("lex_time", "grouping_time", "parse_time", "compile_time", "execute_time")
+        metrics["total_time"] = sum(
+            metrics[phase] for phase in phases if metrics[phase] is not None
+        )
+        lex_time = metrics["lex_time"] + (metrics["grouping_time"] or 0)
+        if lex_time:
+            metrics["tokens_per_second"] = metrics["tokens"] / lex_time
+
+    def run_tokens(self, program_tokens):
+        if DEBUG_ONLY_TOKENS:
+            for token in program_tokens:
+                print(f"\033[33m{token}\033[0m")
+            return
+
+        if program_tokens and program_tokens[-1].kind == UNFINISHED_TOKEN:
+            raise CodeError(
+                "Unfinished token", error_code=1003, error_token=program_tokens[-1]
+            )
+
+        metrics = self.metrics
+        if metrics is None:
+            program = compile_program(
+                parse_tokens(program_tokens),
+                self.slots,
+                self.get_variables(),
+                profile=self.collect_profile,
+            )
+        else:
+            metrics["tokens"] += len(program_tokens)
+            start_time = default_timer()
+            statements = parse_tokens(program_tokens)
+            parse_end_time = default_timer()
+            program = compile_program(
+                statements,
+                self.slots,
+                self.get_variables(),
+                count=True,
+                profile=self.collect_profile,
+            )
+            metrics["parse_time"] += parse_end_time - start_time
+            metrics["compile_time"] += default_timer() - parse_end_time
+            metrics["instructions"] += len(program["code"])
+            metrics["folded_operations"] += program["num_folded"]
+
+        if DEBUG_SHOW_CONSTANT_FOLDING:
+            num_folded = program["num_folded"]
+            print(
+                f"\033[33mDEBUG Folded {num_folded} constant operation{plural_s(num_folded)}\033[0m"
+            )
+        if DEBUG_SHOW_BYTECODE:
+            print(f"\033[33m{disassemble(program)}\033[0m")
+
+        if metrics is None and self.profile is None:
+            run_bytecode(program, self.frame)
+            return
+
+        start_time = default_timer()
+        try:
+            run_bytecode(program, self.frame)
+        finally:
+            if self.profile is not None:
+                add_program_profile(self.profile, program["profile"])
+            if metrics is not None:
+                metrics["execute_time"] += default_timer() - start_time
+                for name, count in zip(COUNTER_NAMES, program["counters"]):
+                    metrics[name] += count
+
+
+def cache_rules(rules_file):
+    # Compile the rules once before starting workers, so every worker can
+    # load them from the cache
+    load_rules(rules_file)
+
+
+def init_worker(rules_file):
+    # Each worker process or thread loads the rules once and keeps them for
+    # everything it runs
+    global worker_interpreter
+    worker_interpreter = Interpreter(rules_file)
+
+
+def get_worker_interpreter():
+    return worker_interpreter
@@ -1,6 +1,197 @@
 # Docs at https://github.com/Blob2763/lex
 
+import hashlib
+import os
+import pickle
 import re
+import stat
+from array import array
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from timeit import default_timer
+
+try:
+    # The regex parser is private, so it might not be there in every Python.
+    # Without it, rules are still matched, just without the shortcuts it allows
+    from re import _parser
+except ImportError:
+    _parser = None
+
+# Change this whenever the rule tables change shape, so old caches are ignored
+LEX_VERSION = 7
+RULES_CACHE_DIRECTORY = "__lexcache__"
+PARALLEL_MIN_CHUNK_SIZE = 1 << 20  # Smaller chunks aren't worth sending to another process
+EDIT_BLOCK_SIZE = 1024  # Tokens in each block of an EditableCode
+
+# Every (class, subclass) pair gets a small number, its kind, the first time it
+# is seen. Tokens store their kind, so checking a token's type is one integer
+# comparison.
+KINDS = [("ERROR", "UNFINISHED_TOKEN")]
+KIND_NUMBERS = {("ERROR", "UNFINISHED_TOKEN"): 0}
+UNFINISHED_TOKEN = 0
+
+LOADED_RULES = {}
+
+
+def intern_kind(token_class: str, subclass: str) -> int:
+    """
+    Gets the kind for a class and subclass, giving it a new kind if it doesn't
+    have one yet.
+
+    Parameters:
+        token_class (str): the class
+        subclass (str): the subclass
+
+    Returns:
+        kind (int): the kind of the class and subclass
+    """
+
+    pair = (token_class, subclass)
+    kind = KIND_NUMBERS.get(pair)
+    if kind is None:
+        kind = len(KINDS)
+        KINDS.append(pair)
+        KIND_NUMBERS[pair] = kind
+
+    return kind
+
+
+def kinds_of_class(token_class: str) -> frozenset:
+    """
+    Gets all the kinds that have been given out so far for a class.
+
+    Parameters:
+        token_class (str): the class
+
+    Returns:
+        kinds (frozenset): the kinds with that class
+    """
+
+    return frozenset(
+        kind for kind, (kind_class, _) in enumerate(KINDS) if kind_class == token_class
+    )
+
+
+class Token:
+    """
+    A single token. Tokens use slots instead of a dictionary, because there
+    can be millions of them.
+
+    Attributes:
+        kind (int): the kind of the rule that produced the token
+        content: the text of the token
+        start_position (int): the position of the first character of the token
+        end_position (int): the position of the last character of the token
+        line_number (int): the line the token ends on
+    """
+
+    __slots__ = ("kind", "content", "start_position", "end_position", "line_number")
+
+    def __init__(
+        self,
+        kind,
+        content,
+        start_position=None,
+        end_position=None,
+        line_number=None,
+    ):
+        self.kind = kind
+        self.content = content
+        self.start_position = start_position
+        self.end_position = end_position
+        self.line_number = line_number
+
+    @property
+    def token_class(self):
+        return KINDS[self.kind][0]
+
+    @property
+    def subclass(self):
+        return KINDS[self.kind][1]
+
+    def __repr__(self):
+        return (
+            f"Token({self.token_class} {self.subclass} {self.content!r}, "
+            f"{self.start_position}-{self.end_position}, line {self.line_number})"
+        )
+
+
+class SourceIndex:
+    """
+    Finds which line a position in some code is on, with a binary search over
+    where each line starts instead of counting lines.
+
+    Attributes:
+        lines (list): the lines of the code, without their newlines
+        line_start_positions (list): the position of the first character of
+        each line, in order
+    """
+
+    __slots__ = ("lines", "line_start_positions")
+
+    def __init__(self, code: str):
+        self.lines = code.split("\n")
+        self.line_start_positions = [0] + [m.end() for m in re.finditer("\n", code)]
+
+    def line_number(self, position: int) -> int:
+        """
+        Finds the line a position is on.
+
+        Parameters:
+            position (int): the position in the code
+
+        Returns:
+            line_number (int): the line the position is on, starting from 1
+        """
+
+        return bisect_right(self.line_start_positions, position)
+
+    def line_start_position(self, line_number: int) -> int:
+        return self.line_start_positions[line_number - 1]
+
+
+def token_start_position(token: Token) -> int:
+    return token.start_position
+
+
+def token_end_position(token: Token) -> int:
+    return token.end_position
+
+
+def find_start_token(tokens: list, position: int) -> Token:
+    """
+    Finds the last token that starts at or before a position, with a binary
+    search, since tokens are in the order they appear in the code.
+
+    Parameters:
+        tokens (list): the tokens to search
+        position (int): the position in the code
+
+    Returns:
+        token (Token): the token, or the first token if they all start after
+        the position
+    """
+
+    index = bisect_right(tokens, position, key=token_start_position)
+    return tokens[max(index - 1, 0)]
+
+
+def find_end_token(tokens: list, position: int) -> Token:
+    """
+    Finds the first token that ends at or after a position, with a binary
+    search, since tokens are in the order they appear in the code.
+
+    Parameters:
+        tokens (list): the tokens to search
+        position (int): the position in the code
+
+    Returns:
+        token (Token): the token, or the last token if they all end before
+        the position
+    """
+
+    index = bisect_left(tokens, position, key=token_end_position)
+    return tokens[min(index, len(tokens) - 1)]
 
 
 def extract_quote_strings(string: str) -> list:
@@ -68,32 +259,62 @@ def is_following_rule(string: str, rule: dict) -> bool:
                 and len(string) >= 2
             )
         case "regex":
-            return re.fullmatch(rule["pattern"], string)
+            return rule["compiled"].fullmatch(string)
         case "endswith":
             return string.endswith(rule["end_string"])
         
 
-def is_following_group(group: dict, token: dict, next_token: dict) -> bool:
+def merge_tokens(group: dict, tokens: list) -> Token:
     """
-    Checks whether a certain pair of tokens should be grouped.
+    Combines a sequence of tokens into one token using a group.
 
     Parameters:
-        group (dict): the group to test
-        token (dict): the first token
-        next_token (dict): the second token
+        group (dict): the group the tokens follow
+        tokens (list): the tokens to combine
 
     Returns:
-        is_pass (bool): whether or not the tokens should be grouped
+        new_token (Token): the grouped token
     """
-    
-    return (
-        group["parts"][0]["class"] == token["class"]
-        and group["parts"][0]["subclass"] == token["subclass"]
-        and group["parts"][1]["class"] == next_token["class"]
-        and group["parts"][0]["subclass"] == token["subclass"]
+
+    return Token(
+        group["result_kind"],
+        "".join(token.content for token in tokens),
+        tokens[0].start_position,
+        tokens[-1].end_position,
+        tokens[0].line_number,
     )
 
 
+def build_group_trie(groups: list) -> dict:
+    """
+    Builds a trie of the groups, where each level is keyed by the kind of the
+    next part. This lets tokens be grouped in one pass, without trying every
+    group at every token.
+
+    Parameters:
+        groups (list): the groups from `generate_rules`
+
+    Returns:
+        group_trie (dict): the root node. Each node has the group that ends
+        there (or None) and its child nodes by kind
+    """
+
+    group_trie = {"group": None, "next": {}}
+    for group in groups:
+        if len(group["parts"]) < 2:
+            # Grouping a single token could go on forever
+            continue
+
+        node = group_trie
+        for part in group["parts"]:
+            node = node["next"].setdefault(part["kind"], {"group": None, "next": {}})
+        if node["group"] is None:
+            # The first group in the rules file wins
+            node["group"] = group
+
+    return group_trie
+
+
 def split_rule_string(rule_string: str):
     """
     Splits a rule string into separate parts.
@@ -122,9 +343,149 @@ def split_rule_string(rule_string: str):
     return match_part, class_name, subclass_name, match_type
 
 
+def regex_first_characters(items) -> tuple:
+    """
+    Works out which characters a parsed regex can start with.
+
+    Parameters:
+        items: the parsed regex, from `re._parser.parse`
+
+    Returns:
+        characters (set): the characters the regex can start with, or None if
+        they can't be worked out
+        can_be_empty (bool): whether the regex can match an empty string
+    """
+
+    characters = set()
+    for op, value in items:
+        if op is _parser.AT:
+            # anchors don't use up any characters
+            continue
+
+        if op is _parser.LITERAL:
+            characters.add(chr(value))
+            return characters, False
+
+        if op is _parser.IN:
+            for class_op, class_value in value:
+                if class_op is _parser.LITERAL:
+                    characters.add(chr(class_value))
+                elif class_op is _parser.RANGE and class_value[1] - class_value[0] < 256:
+                    characters.update(
+                        chr(code) for code in range(class_value[0], class_value[1] + 1)
+                    )
+                else:
+                    return None, False
+            return characters, False
+
+        if op is _parser.SUBPATTERN:
+            (_, add_flags, _, sub_items) = value
+            if add_flags & re.IGNORECASE:
+                return None, False
+            sub_characters, can_be_empty = regex_first_characters(sub_items)
+        elif op is _parser.BRANCH:
+            sub_characters = set()
+            can_be_empty = False
+            for branch_items in value[1]:
+                branch_characters, branch_can_be_empty = regex_first_characters(
+                    branch_items
+                )
+                if branch_characters is None:
+                    return None, False
+                sub_characters |= branch_characters
+                can_be_empty = can_be_empty or branch_can_be_empty
+        elif op in (_parser.MAX_REPEAT, _parser.MIN_REPEAT, _parser.POSSESSIVE_REPEAT):
+            (min_count, max_count, sub_items) = value
+            if max_count == 0:
+                continue
+            sub_characters, can_be_empty = regex_first_characters(sub_items)
+            can_be_empty = can_be_empty or min_count == 0
+        else:
+            return None, False
+
+        if sub_characters is None:
+            return None, False
+        characters |= sub_characters
+        if not can_be_empty:
+            return characters, False
+
+    return characters, True
+
+
+def rule_first_characters(rule: dict):
+    """
+    Works out which characters a token following a rule can start with.
+
+    Parameters:
+        rule (dict): the rule to check
+
+    Returns:
+        characters (set): the possible first characters, or None if the rule
+        could start with any character
+    """
+
+    match rule["rule_type"]:
+        case "equal":
+            first_string = rule["check_string"]
+        case "between":
+            first_string = rule["start_string"]
+        case "regex":
+            if _parser is None:
+                return None
+            try:
+                parsed = _parser.parse(rule["pattern"])
+                if parsed.state.flags & re.IGNORECASE:
+                    return None
+                characters, can_be_empty = regex_first_characters(parsed)
+            except (AttributeError, TypeError, ValueError):
+                # The private parser has changed, so try the rule everywhere
+                return None
+            if can_be_empty:
+                return None
+            return characters
+        case _:
+            return None
+
+    if first_string == "":
+        return None
+    return {first_string[0]}
+
+
+def index_rules(rules: list) -> dict:
+    """
+    Groups the rules by the characters their tokens can start with, so that
+    only the rules that could possibly match need to be tried.
+
+    Parameters:
+        rules (list): the rules to index
+
+    Returns:
+        rule_index (dict): the rule numbers that can start with each character,
+        and the rule numbers to try for any other character. Both keep the
+        order of the rules file
+    """
+
+    any_character = []
+    first_characters = {}
+    for rule_number, rule in enumerate(rules):
+        characters = rule_first_characters(rule)
+        if characters is None:
+            any_character.append(rule_number)
+            continue
+
+        for character in characters:
+            first_characters.setdefault(character, []).append(rule_number)
+
+    for character, rule_numbers in first_characters.items():
+        first_characters[character] = sorted(rule_numbers + any_character)
+
+    return {"first_characters": first_characters, "any_character": any_character}
+
+
 def generate_rules(rules_file):
     """
-    Generates a list of rules based on the contents of a rules file.
+    Generates a list of rules based on the contents of a rules file. Every
+    class and subclass in the file is given a kind with `intern_kind`.
 
     Parameters:
         rules_file (str): the rules in the rules file
@@ -132,6 +493,8 @@ def generate_rules(rules_file):
     Returns:
         rules (list): a list of all the rules as dictionaries
         groups (list): a list of all the rules for groups as dictionaries
+        rule_index (dict): which rules can start with each character, from
+        `index_rules`
     """
 
     all_lines = [rule for rule in rules_file.split("\n") if rule.strip() != ""]
@@ -176,6 +539,7 @@ def generate_rules(rules_file):
         rule = {
             "class": class_name,
             "subclass": subclass_name,
+            "kind": intern_kind(class_name, subclass_name),
             "match_type": match_type,
         }
 
@@ -203,6 +567,7 @@ def generate_rules(rules_file):
             rule["pattern"] = (
                 match_part.strip("matches").strip().encode().decode("unicode_escape")
             )
+            rule["compiled"] = re.compile(rule["pattern"])
             rules.append(rule)
             continue
 
@@ -221,124 +586,1301 @@ def generate_rules(rules_file):
         parts = []
         for part_string in parts_full:
             part_class, part_subclass = part_string.split(" ")
-            parts.append({"class": part_class, "subclass": part_subclass})
+            parts.append(
+                {
+                    "class": part_class,
+                    "subclass": part_subclass,
+                    "kind": intern_kind(part_class, part_subclass),
+                }
+            )
         group_data = {
             "result_class": result_class,
             "result_subclass": result_subclass,
+            "result_kind": intern_kind(result_class, result_subclass),
             "parts": parts,
         }
 
         groups.append(group_data)
 
-    return rules, groups
+    return rules, groups, index_rules(rules)
 
 
-def tokenise(rules_path: str, code_path: str) -> list:
+def simple_repeat_pattern(pattern: str) -> str:
     """
-    Splits the code into a list of tokens.
+    Checks whether a regex is some single characters followed by a greedy
+    repeat of a single character, like `^[a-z]+$`. The regex engine's match
+    of a regex like this is always the longest one, since the repeat takes
+    as many characters as it can and nothing comes after it, so the longest
+    match is found with one regex match instead of trying every length.
+
+    The regex is checked with the regex engine's parser, which is private
+    and can change between Python versions. If it isn't there, or doesn't
+    parse the regex the way this expects, the regex is treated as not
+    being like this, so it is still matched, just more slowly.
 
     Parameters:
-        rules_path (str): the path to the rules file (must be a .lexif file)
-        code_path (str): the path to the code to be tokenised
+        pattern (str): the regex pattern
 
     Returns:
-        tokens (list): a list of all the token dictionaries
+        regex (str): the pattern without its anchors, or None if the regex
+        isn't like this
     """
 
-    if not rules_path.endswith(".lexif"):
-        raise ValueError("rules file should be a .lexif file")
+    if _parser is None:
+        return None
+
+    try:
+        single_character_ops = (
+            _parser.LITERAL,
+            _parser.NOT_LITERAL,
+            _parser.ANY,
+            _parser.IN,
+        )
+        parsed = _parser.parse(pattern)
+        if parsed.state.flags & ~re.UNICODE:
+            # Flags for the whole regex can't go inside the combined regex
+            return None
+        items = list(parsed)
+        if items and items[0] == (_parser.AT, _parser.AT_BEGINNING):
+            if not pattern.startswith("^"):
+                return None
+            pattern = pattern[1:]
+            items = items[1:]
+        if items and items[-1] == (_parser.AT, _parser.AT_END):
+            if not pattern.endswith("$"):
+                return None
+            pattern = pattern[:-1]
+            items = items[:-1]
+
+        if not items or items[-1][0] is not _parser.MAX_REPEAT:
+            return None
+        (_, max_count, repeated_items) = items[-1][1]
+        if max_count is not _parser.MAXREPEAT or len(repeated_items) != 1:
+            return None
+        if all(op in single_character_ops for op, _ in items[:-1] + list(repeated_items)):
+            return pattern
+    except (AttributeError, TypeError, ValueError):
+        pass
+    return None
+
+
+def longest_full_match(compiled, code: str, position: int) -> int:
+    """
+    Finds the longest text from a position that a regex matches all of, by
+    trying every length from the longest down. This is how greedy regex
+    rules that `simple_repeat_pattern` doesn't accept are matched, so it is
+    slow, taking time proportional to the length of the rest of the code.
+
+    Parameters:
+        compiled (re.Pattern): the compiled regex
+        code (str): the code being tokenised
+        position (int): where the match starts
+
+    Returns:
+        end (int): the position just after the end of the match, or None if
+        the regex doesn't match any text from this position
+    """
+
+    # Matched against the text from the position, so anchors are at its start
+    text = code[position:]
+    for length in range(len(text), 0, -1):
+        if compiled.fullmatch(text, 0, length):
+            return position + length
+    return None
+
+
+def rule_regex(rule: dict) -> str:
+    """
+    Converts a rule into a regex that matches the token the rule would produce
+    if the rule was tried from the current position in the code.
+
+    Greedy rules match as much as they can from the current position (maximal
+    munch), so one match finds their token however long it is.
+
+    Regex rules return None, because the regex engine can't be asked for the
+    shortest or longest full match of a pattern. Those rules are probed
+    separately. Greedy regex rules that `simple_repeat_pattern` accepts are
+    the exception.
+
+    Parameters:
+        rule (dict): the rule to convert
+
+    Returns:
+        regex (str): the regex for the rule, or None if the rule has to be probed
+    """
+
+    # Normal rules take the shortest match, greedy rules the longest
+    repeat = "" if rule["match_type"] == "greedy" else "?"
+    match rule["rule_type"]:
+        case "equal":
+            return re.escape(rule["check_string"])
+        case "between":
+            min_length = max(2, len(rule["start_string"]), len(rule["end_string"]))
+            return (
+                f"(?={re.escape(rule['start_string'])})"
+                f"(?s:.{{{min_length},}}{repeat})"
+                f"(?<={re.escape(rule['end_string'])})"
+            )
+        case "regex":
+            if rule["match_type"] == "greedy":
+                return simple_repeat_pattern(rule["pattern"])
+            return None
+        case "endswith":
+            min_length = max(1, len(rule["end_string"]))
+            return f"(?s:.{{{min_length},}}{repeat})(?<={re.escape(rule['end_string'])})"
+
+
+def build_scanner(rules: list, rule_numbers: list) -> dict:
+    """
+    Combines some of the rules into one regex. Every rule is a named lookahead
+    group, so a single match from the current position tells us the token
+    each rule would produce there.
 
-    rules_file = open(rules_path, "r", encoding="utf-8").read()
-    rules, groups = generate_rules(rules_file)
+    Greedy rules use the longest match the regex engine finds from the
+    current position, so their tokens are found in one match however long
+    they are, the same as in the character-by-character lexer. Regex rules
+    that `rule_regex` can't convert are probed after the combined regex.
+
+    A scanner with only one rule, which is an "equal" rule, doesn't need a
+    regex at all. Its token is the rule's string if the code carries on
+    with it, and most tokens, like spaces and brackets, are found this way.
+
+    The regexes aren't compiled until `compile_scanner` is called, so that
+    scanners can be cached and only the ones that are used get compiled.
+
+    Parameters:
+        rules (list): the rules from `generate_rules`
+        rule_numbers (list): the numbers of the rules to include, in order
 
-    code = open(code_path, "r", encoding="utf-8").read()
+    Returns:
+        scanner (dict): the combined regex, the rules it contains, the regex
+        rules that have to be probed, with whether to take their longest
+        match, and the rule number and string of its only rule if that is
+        an "equal" rule
+    """
+
+    equal_rule = None
+    if len(rule_numbers) == 1:
+        rule = rules[rule_numbers[0]]
+        if rule["rule_type"] == "equal" and rule["check_string"] != "":
+            equal_rule = (rule_numbers[0], rule["check_string"])
+
+    regex_parts = []
+    regex_rules = []
+    probe_rules = []
+    for rule_number in rule_numbers:
+        rule = rules[rule_number]
+        regex = rule_regex(rule)
+        if regex is None:
+            is_longest = rule["match_type"] == "greedy"
+            probe_rules.append((rule_number, rule["pattern"], is_longest))
+            continue
+
+        regex_parts.append(f"(?:(?=(?P<rule{rule_number}>{regex})))?")
+        regex_rules.append(rule_number)
+
+    return {
+        "regex": "".join(regex_parts),
+        "regex_rules": regex_rules,
+        "probe_regexes": probe_rules,
+        "equal_rule": equal_rule,
+        "pattern": None,
+        "group_rules": None,
+        "probe_rules": None,
+    }
+
+
+def compile_scanner(scanner: dict) -> dict:
+    """
+    Compiles the regexes of a scanner from `build_scanner`, if they haven't
+    been compiled already.
+
+    Parameters:
+        scanner (dict): the scanner to compile
+
+    Returns:
+        scanner (dict): the same scanner, with its regexes compiled
+    """
 
-    line_start_positions = [0] + [m.end() for m in re.finditer("\n", code)]
+    if scanner["pattern"] is not None:
+        return scanner
+
+    pattern = re.compile(scanner["regex"])
+    scanner["group_rules"] = [
+        (pattern.groupindex[f"rule{rule_number}"], rule_number)
+        for rule_number in scanner["regex_rules"]
+    ]
+    scanner["probe_rules"] = [
+        (rule_number, re.compile(regex), is_longest)
+        for rule_number, regex, is_longest in scanner["probe_regexes"]
+    ]
+    scanner["pattern"] = pattern
+
+    return scanner
+
+
+def build_scanners(rules: list, rule_index: dict) -> dict:
+    """
+    Builds a scanner for each character in the rule index, so that each scanner
+    only has to try the rules that can start with that character.
+
+    Parameters:
+        rules (list): the rules from `generate_rules`
+        rule_index (dict): the rule index from `generate_rules`
+
+    Returns:
+        scanners (dict): the scanner for each first character, and the scanner
+        for any other character
+    """
+
+    return {
+        "first_characters": {
+            character: build_scanner(rules, rule_numbers)
+            for character, rule_numbers in rule_index["first_characters"].items()
+        },
+        "any_character": build_scanner(rules, rule_index["any_character"]),
+    }
+
+
+def match_token(code: str, position: int, scanners: dict) -> tuple:
+    """
+    Finds the token the rules produce from a position in the code. This is the
+    shortest token any rule can produce, with ties going to the rule that comes
+    first in the rules file.
+
+    Parameters:
+        code (str): the code being tokenised
+        position (int): the position the token starts at
+        scanners (dict): the scanners from `build_scanners`
+
+    Returns:
+        end (int): the position just after the end of the token
+        rule_number (int): the number of the rule that produced the token, or
+        None if no rule produces a token from this position
+    """
+
+    code_length = len(code)
+    scanner = scanners["first_characters"].get(
+        code[position], scanners["any_character"]
+    )
+    equal_rule = scanner["equal_rule"]
+    if equal_rule is not None:
+        (rule_number, check_string) = equal_rule
+        if code.startswith(check_string, position):
+            return position + len(check_string), rule_number
+        return code_length + 1, None
+
+    if scanner["pattern"] is None:
+        compile_scanner(scanner)
+    spans = scanner["pattern"].match(code, position).regs
+
+    best_end = code_length + 1
+    best_rule_number = None
+    for group_number, rule_number in scanner["group_rules"]:
+        end = spans[group_number][1]
+        if position < end < best_end:
+            best_end = end
+            best_rule_number = rule_number
+
+    for rule_number, compiled, is_longest in scanner["probe_rules"]:
+        if is_longest:
+            end = longest_full_match(compiled, code, position)
+            if end is not None and (
+                end < best_end or (end == best_end and rule_number < best_rule_number)
+            ):
+                best_end = end
+                best_rule_number = rule_number
+            continue
+
+        # Matched against the text from the position, so anchors are at its start
+        text = code[position : min(best_end, code_length)]
+        for length in range(1, len(text) + 1):
+            if position + length == best_end and rule_number > best_rule_number:
+                break
+            if compiled.fullmatch(text, 0, length):
+                best_end = position + length
+                best_rule_number = rule_number
+                break
+
+    return best_end, best_rule_number
+
+
+def scan_tokens(
+    code: str, rules: list, scanners: dict, position: int = 0, line_number: int = 1
+):
+    """
+    Splits the code into tokens using the scanners from `build_scanners`.
+    Tokens are yielded one at a time, so they can be grouped as they are
+    scanned.
+
+    Parameters:
+        code (str): the code to be tokenised
+        rules (list): the rules the scanners were built from
+        scanners (dict): the scanners from `build_scanners`
+        position (int): where to start scanning, which must be the start of a token
+        line_number (int): the line that position is on
+
+    Yields:
+        token (Token): each token, before grouping
+    """
+
+    code_length = len(code)
+    while position < code_length:
+        end, rule_number = match_token(code, position, scanners)
+
+        if rule_number is None:
+            yield Token(
+                UNFINISHED_TOKEN,
+                code[position:],
+                position,
+                code_length - 1,
+                line_number + code.count("\n", position, code_length - 1),
+            )
+            break
+
+        yield Token(
+            rules[rule_number]["kind"],
+            code[position:end],
+            position,
+            end - 1,
+            line_number + code.count("\n", position, end - 1),
+        )
+        line_number += code.count("\n", position, end)
+        position = end
+
+
+def scan_grouped_tokens(
+    code: str, rule_tables: dict, position: int = 0, line_number: int = 1
+) -> list:
+    """
+    Splits the code into a list of tokens using the scanners from
+    `build_scanners`, grouping the tokens in the same loop. This gives the
+    same tokens as grouping the tokens from `scan_tokens`, but it is quicker,
+    since tokens that can't start a group are added to the list straight
+    away, without going through a generator for each step.
+
+    Parameters:
+        code (str): the code to be tokenised
+        rule_tables (dict): the rule tables from `load_rules`
+        position (int): where to start scanning, which must be the start of a token
+        line_number (int): the line that position is on
+
+    Returns:
+        tokens (list): the tokens, after grouping
+    """
+
+    scanners = rule_tables["scanners"]
+    group_trie = rule_tables["group_trie"]
+    group_start_kinds = group_trie["next"]
+    rule_kinds = [rule["kind"] for rule in rule_tables["rules"]]
+
+    tokens = []
+    pending_tokens = []
+    code_length = len(code)
+    while position < code_length:
+        end, rule_number = match_token(code, position, scanners)
+        if rule_number is None:
+            kind = UNFINISHED_TOKEN
+            end = code_length
+        else:
+            kind = rule_kinds[rule_number]
+
+        content = code[position:end]
+        token_line_number = line_number
+        num_newlines = content.count("\n")
+        if num_newlines:
+            # A token's line is the line of its last character
+            line_number += num_newlines
+            token_line_number = line_number - (content[-1] == "\n")
+
+        token = Token(kind, content, position, end - 1, token_line_number)
+        if pending_tokens or kind in group_start_kinds:
+            pending_tokens.append(token)
+            add_grouped_tokens(pending_tokens, group_trie, tokens, False)
+        else:
+            tokens.append(token)
+        position = end
+
+    add_grouped_tokens(pending_tokens, group_trie, tokens, True)
+    return tokens
+
+
+def stream_tokens(code_file, rules: list, scanners: dict, chunk_size: int):
+    """
+    Reads the code from a file in chunks and yields its tokens as soon as they
+    are known. A token is only yielded once the code after it has been read,
+    so that tokens that continue into the next chunk aren't cut short.
+
+    Parameters:
+        code_file: the open code file
+        rules (list): the rules the scanners were built from
+        scanners (dict): the scanners from `build_scanners`
+        chunk_size (int): the number of characters to read at a time
+
+    Yields:
+        token (Token): each token, before grouping
+    """
+
+    buffer = ""
+    buffer_position = 0  # where the buffer starts in the code
+    position = 0
+    line_number = 1
+    is_end_of_file = False
+    while True:
+        if position < len(buffer):
+            end, rule_number = match_token(buffer, position, scanners)
+
+            if rule_number is None and is_end_of_file:
+                yield Token(
+                    UNFINISHED_TOKEN,
+                    buffer[position:],
+                    buffer_position + position,
+                    buffer_position + len(buffer) - 1,
+                    line_number + buffer.count("\n", position, len(buffer) - 1),
+                )
+                break
+
+            if rule_number is not None and (is_end_of_file or end < len(buffer)):
+                rule = rules[rule_number]
+                yield Token(
+                    rule["kind"],
+                    buffer[position:end],
+                    buffer_position + position,
+                    buffer_position + end - 1,
+                    line_number + buffer.count("\n", position, end - 1),
+                )
+                line_number += buffer.count("\n", position, end)
+                position = end
+                continue
+        elif is_end_of_file:
+            break
+
+        # The token might carry on into the next chunk
+        chunk = code_file.read(chunk_size)
+        is_end_of_file = chunk == ""
+        buffer = buffer[position:] + chunk
+        buffer_position += position
+        position = 0
+
+
+def scan_characters(code: str, rules: list, rule_index: dict) -> list:
+    """
+    Splits the code into a list of tokens by growing each token one character
+    at a time and checking it against every rule that can start with the
+    token's first character.
+
+    Greedy rules aren't checked at every character. Where each one's token
+    would end is found when the token starts, with one regex match where
+    `rule_regex` gives a regex, or with `longest_full_match` where it
+    doesn't, and the rule passes when the token reaches that length. This
+    finds the longest token, even when a shorter one can't be made one
+    character longer.
+
+    Parameters:
+        code (str): the code to be tokenised
+        rules (list): the rules from `generate_rules`
+        rule_index (dict): the rule index from `generate_rules`
+
+    Returns:
+        tokens (list): a list of all the tokens, before grouping
+    """
+
+    source_index = SourceIndex(code)
+
+    first_character_rules = {
+        character: [rules[rule_number] for rule_number in rule_numbers]
+        for character, rule_numbers in rule_index["first_characters"].items()
+    }
+    any_character_rules = [
+        rules[rule_number] for rule_number in rule_index["any_character"]
+    ]
+    greedy_patterns = {}
+    for rule in rules:
+        if rule["match_type"] == "greedy":
+            regex = rule_regex(rule)
+            greedy_patterns[id(rule)] = None if regex is None else re.compile(regex)
 
     tokens = []
     current_token = ""
     recent_token_end = -1
-    line_number = 1
     for i, char in enumerate(code):
-        line_number = len(
-            [
-                line_start_position
-                for line_start_position in line_start_positions
-                if line_start_position <= i
-            ]
-        )
-
         current_token += char
+        if len(current_token) == 1:
+            candidate_rules = first_character_rules.get(char, any_character_rules)
 
-        for rule in rules:
-            is_normal_pass = rule["match_type"] == "normal" and is_following_rule(
-                current_token, rule
-            )
-            if i < len(code) - 1:
-                is_greedy_pass = (
-                    rule["match_type"] == "greedy"
-                    and is_following_rule(current_token, rule)
-                    and not is_following_rule(current_token + code[i + 1], rule)
-                )
+            # Where each greedy rule's token ends, or None if it has no token here
+            greedy_ends = []
+            for rule in candidate_rules:
+                greedy_end = None
+                if rule["match_type"] == "greedy":
+                    greedy_pattern = greedy_patterns[id(rule)]
+                    if greedy_pattern is None:
+                        greedy_end = longest_full_match(rule["compiled"], code, i)
+                    else:
+                        match = greedy_pattern.match(code, i)
+                        greedy_end = match.end() if match else None
+                greedy_ends.append(greedy_end)
+
+        for rule, greedy_end in zip(candidate_rules, greedy_ends):
+            if rule["match_type"] == "greedy":
+                is_pass = greedy_end == i + 1
             else:
-                is_greedy_pass = rule["match_type"] == "greedy" and is_following_rule(
-                    current_token, rule
-                )
+                is_pass = is_following_rule(current_token, rule)
 
-            if is_normal_pass or is_greedy_pass:
+            if is_pass:
                 tokens.append(
-                    {
-                        "class": rule["class"],
-                        "subclass": rule["subclass"],
-                        "content": current_token,
-                        "start_position": recent_token_end + 1,
-                        "end_position": i,
-                        "line_number": line_number,
-                    }
+                    Token(
+                        rule["kind"],
+                        current_token,
+                        recent_token_end + 1,
+                        i,
+                        source_index.line_number(i),
+                    )
                 )
                 recent_token_end = i
                 current_token = ""
                 break
     if current_token != "":
         tokens.append(
-            {
-                "class": "ERROR",
-                "subclass": "UNFINISHED_TOKEN",
-                "content": current_token,
-                "start_position": recent_token_end + 1,
-                "end_position": i,
-                "line_number": line_number,
-            }
+            Token(
+                UNFINISHED_TOKEN,
+                current_token,
+                recent_token_end + 1,
+                i,
+                source_index.line_number(i),
+            )
         )
 
+    return tokens
+
+
+def build_rule_tables(rules_file: str) -> dict:
+    """
+    Builds everything the lexer needs from the contents of a rules file.
+
+    Parameters:
+        rules_file (str): the rules in the rules file
+
+    Returns:
+        rule_tables (dict): the rules, groups and rule index from
+        `generate_rules`, the scanners from `build_scanners`, the group trie
+        from `build_group_trie`, and the kind of every class and subclass the
+        rules use
+    """
+
+    rules, groups, rule_index = generate_rules(rules_file)
+
+    kinds = {}
+    for rule in rules:
+        kinds[rule["class"], rule["subclass"]] = rule["kind"]
+    for group in groups:
+        for part in group["parts"]:
+            kinds[part["class"], part["subclass"]] = part["kind"]
+        kinds[group["result_class"], group["result_subclass"]] = group["result_kind"]
+
+    return {
+        "rules": rules,
+        "groups": groups,
+        "rule_index": rule_index,
+        "scanners": build_scanners(rules, rule_index),
+        "group_trie": build_group_trie(groups),
+        "kinds": kinds,
+    }
+
+
+def cached_kinds_match(kinds: dict) -> bool:
+    """
+    Checks whether the kinds in cached rule tables are the kinds this process
+    would give out for them, without giving out any kinds. Kinds this process
+    hasn't given out yet have to be the next ones it would give out.
+
+    Parameters:
+        kinds (dict): the kind of each class and subclass in the tables
+
+    Returns:
+        is_match (bool): whether every kind matches
+    """
+
+    next_kind = len(KINDS)
+    for pair, kind in sorted(kinds.items(), key=lambda item: item[1]):
+        known_kind = KIND_NUMBERS.get(pair)
+        if known_kind is None:
+            if kind != next_kind:
+                return False
+            next_kind += 1
+        elif known_kind != kind:
+            return False
+
+    return True
+
+
+def is_private_path(path_status) -> bool:
+    """
+    Checks that a file or directory belongs to the user running this process,
+    and that no other user can write to it.
+
+    Parameters:
+        path_status (os.stat_result): the status of the file or directory
+
+    Returns:
+        is_private (bool): whether only this user can change it
+    """
+
+    if path_status.st_uid != os.getuid():
+        return False
+    return not path_status.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def load_rules(rules_path: str, use_cache: bool = True) -> dict:
+    """
+    Loads the rule tables for a rules file. The tables are cached on disk next
+    to the rules file, and the cache is used as long as the rules file and
+    `LEX_VERSION` haven't changed. Tables that have already been loaded by
+    this process are reused. The time it took to load them the first time
+    is kept in the tables as "load_time".
+
+    The cache is a pickle, and loading a pickle can run any code in it, so a
+    cache is only loaded if it and its directory belong to the user running
+    this process and no other user can write to them. Where owners can't be
+    checked, like on Windows, the cache isn't used at all.
+
+    Parameters:
+        rules_path (str): the path to the rules file (must be a .lexif file)
+        use_cache (bool): whether to read and write the cache
+
+    Returns:
+        rule_tables (dict): the rule tables from `build_rule_tables`
+    """
+
+    if not rules_path.endswith(".lexif"):
+        raise ValueError("rules file should be a .lexif file")
+
+    start_time = default_timer()
+    with open(rules_path, "r", encoding="utf-8") as file:
+        rules_file = file.read()
+    if not use_cache:
+        return build_rule_tables(rules_file)
+
+    rules_hash = hashlib.sha256(f"{LEX_VERSION}\n{rules_file}".encode()).hexdigest()
+    if rules_hash in LOADED_RULES:
+        return LOADED_RULES[rules_hash]
+
+    if not hasattr(os, "getuid"):
+        # The owner of the cache can't be checked, so it isn't safe to load
+        rule_tables = build_rule_tables(rules_file)
+        LOADED_RULES[rules_hash] = rule_tables
+        rule_tables["load_time"] = default_timer() - start_time
+        return rule_tables
+
+    cache_directory = os.path.join(
+        os.path.dirname(os.path.abspath(rules_path)), RULES_CACHE_DIRECTORY
+    )
+    cache_path = os.path.join(cache_directory, f"{rules_hash}.pickle")
+
+    try:
+        with open(cache_path, "rb") as cache_file:
+            # The open file is checked, so it can't be swapped after the check
+            if is_private_path(os.stat(cache_directory)) and is_private_path(
+                os.fstat(cache_file.fileno())
+            ):
+                rule_tables = pickle.load(cache_file)
+
+                # The cached kinds are only right if this process would give
+                # out the same kinds, which it will unless it has already
+                # loaded other rules
+                if cached_kinds_match(rule_tables["kinds"]):
+                    for pair, kind in sorted(
+                        rule_tables["kinds"].items(), key=lambda item: item[1]
+                    ):
+                        intern_kind(*pair)
+                    rule_tables["load_time"] = default_timer() - start_time
+                    LOADED_RULES[rules_hash] = rule_tables
+                    return rule_tables
+    except Exception:
+        # Missing or unreadable cache, so build the tables again
+        pass
+
+    rule_tables = build_rule_tables(rules_file)
+    LOADED_RULES[rules_hash] = rule_tables
+
+    try:
+        os.makedirs(cache_directory, mode=0o700, exist_ok=True)
+        if is_private_path(os.stat(cache_directory)):
+            # Only this user can read or write the cache
+            temporary_path = f"{cache_path}.{os.getpid()}.tmp"
+            file_descriptor = os.open(
+                temporary_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600
+            )
+            with open(file_descriptor, "wb") as cache_file:
+                pickle.dump(rule_tables, cache_file)
+            os.replace(temporary_path, cache_path)
+    except OSError:
+        # The lexer still works without a cache
+        pass
+
+    rule_tables["load_time"] = default_timer() - start_time
+    return rule_tables
+
+
+def tokenise(
+    rules_path: str, code_path: str, compiled: bool = True, rule_tables: dict = None
+) -> list:
+    """
+    Splits the code into a list of tokens.
+
+    Parameters:
+        rules_path (str): the path to the rules file (must be a .lexif file)
+        code_path (str): the path to the code to be tokenised
+        compiled (bool): whether to use the compiled scanner instead of
+        growing each token one character at a time
+        rule_tables (dict): the rule tables, if they have already been
+        loaded from the rules file
+
+    Returns:
+        tokens (list): a list of all the tokens
+    """
+
+    with open(code_path, "r", encoding="utf-8") as code_file:
+        code = code_file.read()
+
+    return tokenise_code(rules_path, code, compiled, rule_tables)
+
+
+def tokenise_code(
+    rules_path: str, code: str, compiled: bool = True, rule_tables: dict = None
+) -> list:
+    """
+    Splits a string of code into a list of tokens.
+
+    Parameters:
+        rules_path (str): the path to the rules file (must be a .lexif file)
+        code (str): the code to be tokenised
+        compiled (bool): whether to use the compiled scanner instead of
+        growing each token one character at a time
+        rule_tables (dict): the rule tables, if they have already been
+        loaded from the rules file
+
+    Returns:
+        tokens (list): a list of all the tokens
+    """
+
+    if rule_tables is None:
+        rule_tables = load_rules(rules_path)
+    if compiled:
+        return scan_grouped_tokens(code, rule_tables)
+
+    tokens = scan_characters(code, rule_tables["rules"], rule_tables["rule_index"])
+    return list(group_tokens(tokens, rule_tables["group_trie"]))
+
+
+def add_grouped_tokens(
+    pending_tokens: list, group_trie: dict, tokens: list, is_end: bool
+):
+    """
+    Groups the tokens at the start of a list of tokens that are waiting to be
+    grouped, and moves them to the grouped tokens, until the tokens left
+    could still be part of a group with tokens that haven't come yet.
+
+    At each token, the longest sequence of tokens that follows a group is
+    combined into one token, which can then start another group.
+
+    Parameters:
+        pending_tokens (list): the tokens waiting to be grouped, in order
+        group_trie (dict): the group trie from `build_group_trie`
+        tokens (list): the grouped tokens, added to
+        is_end (bool): whether no more tokens are coming, so every pending
+        token has to be grouped
+    """
+
+    while pending_tokens:
+        node = group_trie
+        longest_group = None
+        longest_length = 0
+        for length, token in enumerate(pending_tokens, start=1):
+            node = node["next"].get(token.kind)
+            if node is None:
+                break
+            if node["group"] is not None:
+                longest_group = node["group"]
+                longest_length = length
+
+        if node is not None and node["next"] and not is_end:
+            # A longer group might still be made with the next token
+            return
+
+        if longest_group is not None:
+            pending_tokens[:longest_length] = [
+                merge_tokens(longest_group, pending_tokens[:longest_length])
+            ]
+        else:
+            tokens.append(pending_tokens.pop(0))
+
+
+def group_tokens(token_stream, group_trie: dict):
+    """
+    Groups tokens in one pass from left to right, with `add_grouped_tokens`.
+    Tokens are held back only while they could still be part of a group, so
+    this also works on a stream of tokens.
+
+    Parameters:
+        token_stream: an iterable of tokens
+        group_trie (dict): the group trie from `build_group_trie`
+
+    Yields:
+        token (Token): each token, after grouping
+    """
+
+    pending_tokens = []
+    grouped_tokens = []
+    for token in token_stream:
+        pending_tokens.append(token)
+        add_grouped_tokens(pending_tokens, group_trie, grouped_tokens, False)
+        if grouped_tokens:
+            yield from grouped_tokens
+            grouped_tokens.clear()
+
+    add_grouped_tokens(pending_tokens, group_trie, grouped_tokens, True)
+    yield from grouped_tokens
+
+
+class EditableCode:
+    """
+    Some code and its tokens, kept up to date as the code is edited. Each
+    edit only tokenises the code again around the edit (see `edit`).
+
+    The tokens are kept in blocks of about EDIT_BLOCK_SIZE tokens, each with
+    a shift for the positions and line numbers of its tokens. An edit moves
+    the tokens after it by changing the shift of each block after it,
+    instead of making a new token for each of them, so it takes about as
+    long however much code comes after it. The moved tokens are only made
+    when they are next asked for, by `get_tokens`.
+
+    Attributes:
+        rule_tables (dict): the rule tables used to tokenise the code
+        code (str): the code
+        blocks (list): the blocks of tokens, in order, none of them empty
+        shifts (list): how far the tokens in each block have moved since
+        they were made
+        line_shifts (list): how many lines the tokens in each block have
+        moved since they were made
+    """
+
+    __slots__ = ("rule_tables", "code", "blocks", "shifts", "line_shifts")
+
+    def __init__(self, rules_path: str, code: str, rule_tables: dict = None):
+        self.rule_tables = load_rules(rules_path) if rule_tables is None else rule_tables
+        self.code = code
+        self.blocks = split_blocks(scan_grouped_tokens(code, self.rule_tables))
+        self.shifts = [0] * len(self.blocks)
+        self.line_shifts = [0] * len(self.blocks)
+
+    def get_tokens(self) -> list:
+        """
+        Gets the tokens of the code, the same as `tokenise_code` would give.
+
+        Returns:
+            tokens (list): the tokens
+        """
+
+        tokens = []
+        for block_index in range(len(self.blocks)):
+            tokens.extend(self.moved_block(block_index))
+        return tokens
+
+    def moved_block(self, block_index: int) -> list:
+        # Makes new tokens for a block that has moved, so its tokens can be read
+        block = self.blocks[block_index]
+        shift = self.shifts[block_index]
+        line_shift = self.line_shifts[block_index]
+        if shift or line_shift:
+            block = [
+                Token(
+                    token.kind,
+                    token.content,
+                    token.start_position + shift,
+                    token.end_position + shift,
+                    token.line_number + line_shift,
+                )
+                for token in block
+            ]
+            self.blocks[block_index] = block
+            self.shifts[block_index] = 0
+            self.line_shifts[block_index] = 0
+        return block
+
+    def block_start_position(self, block_index: int) -> int:
+        return self.blocks[block_index][0].start_position + self.shifts[block_index]
+
+    def edit(self, offset: int, removed_length: int, inserted_text: str):
+        """
+        Edits the code and updates its tokens. Scanning starts a few tokens
+        before the edit, in case the edit changes how they end or group, and
+        stops at the first token after the edit that is the same as a token
+        in the old tokens, since everything after that must be the same too.
+        The old tokens after that point are kept, and moved by the change in
+        length and lines.
+
+        Tokens already returned by `get_tokens` are left unchanged.
+
+        Parameters:
+            offset (int): where the edit starts in the code
+            removed_length (int): the number of characters the edit removes
+            inserted_text (str): the text the edit inserts at offset
+
+        Raises:
+            ValueError: if the edit isn't inside the code
+        """
+
+        code = self.code
+        if offset < 0 or removed_length < 0 or offset + removed_length > len(code):
+            raise ValueError("edit is outside the code")
+
+        rule_tables = self.rule_tables
+        blocks = self.blocks
+        shifts = self.shifts
+        line_shifts = self.line_shifts
+        new_code = code[:offset] + inserted_text + code[offset + removed_length :]
+        edit_end = offset + len(inserted_text)
+        shift = len(inserted_text) - removed_length
+        line_shift = inserted_text.count("\n") - code.count(
+            "\n", offset, offset + removed_length
+        )
+
+        # Find the first token that ends at or after the edit. The token just
+        # before it could carry on into the edit, and the tokens before that
+        # could group with it, so scanning starts a few tokens earlier
+        block_index = max(
+            bisect_right(range(len(blocks)), offset, key=self.block_start_position) - 1,
+            0,
+        )
+        token_index = 0
+        if blocks:
+            token_index = bisect_left(
+                blocks[block_index],
+                offset - shifts[block_index],
+                key=token_end_position,
+            )
+        backtrack = group_backtrack(rule_tables)
+        while token_index < backtrack and block_index > 0:
+            block_index -= 1
+            token_index += len(blocks[block_index])
+        token_index = max(token_index - backtrack, 0)
+
+        first_block_index = block_index
+        restart_token = None
+        middle = []
+        if blocks:
+            restart_token = self.moved_block(block_index)[token_index]
+            middle = blocks[block_index][:token_index]
+
+        new_tokens, block_index, token_index = resync_tokens(
+            new_code,
+            rule_tables,
+            restart_token,
+            blocks,
+            block_index,
+            token_index,
+            shifts,
+            shift,
+            edit_end,
+        )
+        middle.extend(new_tokens)
+
+        if block_index < len(blocks):
+            # Every block from here on moves with the edit
+            for moved_index in range(block_index, len(blocks)):
+                shifts[moved_index] += shift
+                line_shifts[moved_index] += line_shift
+            if token_index:
+                # Only part of this block is kept, so it joins the new tokens
+                middle.extend(self.moved_block(block_index)[token_index:])
+                block_index += 1
+
+        if len(middle) < EDIT_BLOCK_SIZE // 2 and block_index < len(blocks):
+            # Keep blocks from getting small
+            middle.extend(self.moved_block(block_index))
+            block_index += 1
+
+        new_blocks = split_blocks(middle)
+        blocks[first_block_index:block_index] = new_blocks
+        shifts[first_block_index:block_index] = [0] * len(new_blocks)
+        line_shifts[first_block_index:block_index] = [0] * len(new_blocks)
+        self.code = new_code
+
+
+def group_backtrack(rule_tables: dict) -> int:
+    # The token before a change could carry on into it, and the tokens before
+    # that could group with it, so tokenising again starts this many tokens back
+    return max([2] + [len(group["parts"]) for group in rule_tables["groups"]])
+
+
+def resync_tokens(
+    code: str,
+    rule_tables: dict,
+    restart_token: Token,
+    old_blocks: list,
+    block_index: int,
+    token_index: int,
+    old_shifts: list = None,
+    shift: int = 0,
+    resync_position: int = 0,
+) -> tuple:
+    """
+    Tokenises code again from a token, until a new token is the same as one
+    of some old tokens: it starts where the old token would start now, with
+    the same kind and content. Everything after that must be the same as the
+    old tokens too, so it doesn't need tokenising again.
+
+    Parameters:
+        code (str): the code
+        rule_tables (dict): the rule tables to tokenise with
+        restart_token (Token): the token to start from, with its position in
+        the code, or None to start from the start of the code
+        old_blocks (list): the old tokens, in lists of tokens in order
+        block_index (int): the block of the first old token that can match
+        token_index (int): the index of that token in its block
+        old_shifts (list): how far the tokens in each old block have moved
+        since they were made, or None if they haven't
+        shift (int): how far the old tokens have moved in the code since then
+        resync_position (int): where new tokens can start being the same as
+        old ones
+
+    Returns:
+        tokens (list): the new tokens before the one that is the same
+        block_index (int): the block of the old token that is the same, or
+        the number of old blocks if no token is
+        token_index (int): the index of that token in its block
+    """
+
+    if old_shifts is None:
+        old_shifts = [0] * len(old_blocks)
+
+    position = 0
+    line_number = 1
+    if restart_token is not None:
+        position = restart_token.start_position
+        # A token's line is the line of its last character
+        content = restart_token.content
+        line_number = restart_token.line_number - content.count("\n", 0, len(content) - 1)
+
+    tokens = []
+    token_stream = scan_tokens(
+        code, rule_tables["rules"], rule_tables["scanners"], position, line_number
+    )
+    for token in group_tokens(token_stream, rule_tables["group_trie"]):
+        if token.start_position >= resync_position:
+            # Skip old tokens that start before this token, and whole blocks
+            # that it has already passed
+            old_start_position = token.start_position - shift
+            while block_index < len(old_blocks):
+                block = old_blocks[block_index]
+                block_shift = old_shifts[block_index]
+                while (
+                    token_index < len(block)
+                    and block[token_index].start_position + block_shift
+                    < old_start_position
+                ):
+                    token_index += 1
+                if token_index < len(block):
+                    break
+                block_index += 1
+                token_index = 0
+
+            if block_index < len(old_blocks):
+                old_token = old_blocks[block_index][token_index]
+                if (
+                    old_token.start_position + old_shifts[block_index] == old_start_position
+                    and old_token.kind == token.kind
+                    and old_token.content == token.content
+                ):
+                    return tokens, block_index, token_index
+
+        tokens.append(token)
+
+    return tokens, len(old_blocks), 0
+
+
+def split_blocks(tokens: list) -> list:
+    return [
+        tokens[start : start + EDIT_BLOCK_SIZE]
+        for start in range(0, len(tokens), EDIT_BLOCK_SIZE)
+    ]
+
+
+def tokenise_chunk(rules_path: str, chunk: str, position: int, line_number: int):
+    """
+    Tokenises one chunk of some code in a worker process, as if a token
+    starts at the start of the chunk. The tokens are sent back as arrays of
+    numbers, which are much quicker to send between processes than tokens.
+
+    Parameters:
+        rules_path (str): the path to the rules file (must be a .lexif file)
+        chunk (str): the chunk of code
+        position (int): where the chunk starts in the code
+        line_number (int): the line the chunk starts on
+
+    Returns:
+        kinds (list): the (class, subclass) pair for each kind in this
+        process, since another process may have given out different kinds
+        token_kinds (array): the kind of each token
+        start_positions (array): the start position of each token in the code
+        end_positions (array): the end position of each token in the code
+        line_numbers (array): the line number of each token
+    """
+
+    rule_tables = load_rules(rules_path)
+
+    token_kinds = array("q")
+    start_positions = array("q")
+    end_positions = array("q")
+    line_numbers = array("q")
+    for token in scan_grouped_tokens(chunk, rule_tables, 0, line_number):
+        token_kinds.append(token.kind)
+        start_positions.append(token.start_position + position)
+        end_positions.append(token.end_position + position)
+        line_numbers.append(token.line_number)
+
+    return list(KINDS), token_kinds, start_positions, end_positions, line_numbers
+
+
+def split_chunks(code: str, chunk_size: int) -> list:
+    # Chunks start after a newline, which is usually the start of a token
+    chunk_starts = [0]
     while True:
-        has_grouped = False
-        grouped_tokens = []
-        i = 0
-        while i < len(tokens):
-            token = tokens[i]
-            if i + 1 < len(tokens):
-                next_token = tokens[i + 1]
-                for group in groups:
-                    if is_following_group(group, token, next_token):
-                        has_grouped = True
-                        new_token = {
-                            "class": group["result_class"],
-                            "subclass": group["result_subclass"],
-                            "content": token["content"] + next_token["content"],
-                            "start_position": token["start_position"],
-                            "end_position": next_token["end_position"],
-                            "line_number": token["line_number"],
-                        }
-                        
-                        token = new_token
-                        i += 1
-            grouped_tokens.append(token)
-            i += 1
-        tokens = grouped_tokens
-        
-        if not has_grouped:
-            # Break if no more groups can be made
+        newline_position = code.find("\n", chunk_starts[-1] + chunk_size)
+        if newline_position == -1 or newline_position + 1 >= len(code):
+            return chunk_starts
+        chunk_starts.append(newline_position + 1)
+
+
+def stitch_chunks(code: str, chunks: list, rule_tables: dict) -> list:
+    """
+    Joins the tokens of chunks that were tokenised separately. The tokens
+    either side of each join are tokenised again, starting a few tokens
+    before it, until a token is found that is also in the chunk after it.
+    This fixes tokens and groups that cross the join, and chunks that didn't
+    really start at the start of a token, such as ones starting in a string.
+
+    Parameters:
+        code (str): the code
+        chunks (list): the tokens of each chunk, in order
+        rule_tables (dict): the rule tables the chunks were tokenised with
+
+    Returns:
+        tokens (list): the tokens of the code, the same as `tokenise_code`
+        would give
+    """
+
+    tokens = list(chunks[0])
+    backtrack = group_backtrack(rule_tables)
+    chunk_number = 1
+    while chunk_number < len(chunks):
+        restart_index = max(len(tokens) - backtrack, 0)
+        restart_token = tokens[restart_index] if tokens else None
+        del tokens[restart_index:]
+
+        new_tokens, chunk_number, chunk_index = resync_tokens(
+            code, rule_tables, restart_token, chunks, chunk_number, 0
+        )
+        tokens.extend(new_tokens)
+        if chunk_number == len(chunks):
+            # Tokenised to the end of the code without finding a join
             break
 
+        tokens.extend(chunks[chunk_number][chunk_index:])
+        chunk_number += 1
+
     return tokens
+
+
+def tokenise_parallel(
+    rules_path: str,
+    code: str,
+    workers: int = None,
+    chunk_size: int = None,
+    rule_tables: dict = None,
+) -> list:
+    """
+    Splits a string of code into a list of tokens, tokenising chunks of it in
+    separate processes. The result is the same as `tokenise_code`.
+
+    Parameters:
+        rules_path (str): the path to the rules file (must be a .lexif file)
+        code (str): the code to be tokenised
+        workers (int): the number of processes, the number of CPUs if None
+        chunk_size (int): the rough size of each chunk, enough to give every
+        process one chunk if None, but at least PARALLEL_MIN_CHUNK_SIZE
+        rule_tables (dict): the rule tables, if they have already been
+        loaded from the rules file, which the worker processes still load
+
+    Returns:
+        tokens (list): a list of all the tokens
+    """
+
+    if rule_tables is None:
+        rule_tables = load_rules(rules_path)
+    workers = workers or os.cpu_count() or 1
+    if chunk_size is None:
+        chunk_size = max(-(-len(code) // workers), PARALLEL_MIN_CHUNK_SIZE)
+
+    chunk_starts = split_chunks(code, chunk_size)
+    if workers == 1 or len(chunk_starts) == 1:
+        return tokenise_code(rules_path, code, rule_tables=rule_tables)
+
+    chunk_ends = chunk_starts[1:] + [len(code)]
+    line_numbers = [1]
+    for start, end in zip(chunk_starts, chunk_ends[:-1]):
+        line_numbers.append(line_numbers[-1] + code.count("\n", start, end))
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunk_starts))) as executor:
+        results = executor.map(
+            tokenise_chunk,
+            [rules_path] * len(chunk_starts),
+            [code[start:end] for start, end in zip(chunk_starts, chunk_ends)],
+            chunk_starts,
+            line_numbers,
+        )
+
+        chunks = []
+        for kinds, token_kinds, start_positions, end_positions, chunk_line_numbers in results:
+            kind_map = [intern_kind(*pair) for pair in kinds]
+            chunks.append(
+                [
+                    Token(kind_map[kind], code[start:end + 1], start, end, line_number)
+                    for kind, start, end, line_number in zip(
+                        token_kinds, start_positions, end_positions, chunk_line_numbers
+                    )
+                ]
+            )
+
+    return stitch_chunks(code, chunks, rule_tables)
+
+
+def tokenise_stream(
+    rules_path: str, code_path: str, chunk_size: int = 65536, rule_tables: dict = None
+):
+    """
+    Splits the code into tokens while it is being read, so that the first
+    tokens are available before the whole file has been read.
+
+    Parameters:
+        rules_path (str): the path to the rules file (must be a .lexif file)
+        code_path (str): the path to the code to be tokenised
+        chunk_size (int): the number of characters to read at a time
+        rule_tables (dict): the rule tables, if they have already been
+        loaded from the rules file
+
+    Yields:
+        token (Token): each token, after grouping
+    """
+
+    if rule_tables is None:
+        rule_tables = load_rules(rules_path)
+
+    with open(code_path, "r", encoding="utf-8") as code_file:
+        yield from group_tokens(
+            stream_tokens(
+                code_file, rule_tables["rules"], rule_tables["scanners"], chunk_size
+            ),
+            rule_tables["group_trie"],
+        )
@@ -0,0 +1,107 @@
+import atexit
+import sys
+
+OUTPUT_BUFFER_SIZE = 65536  # Characters to collect before writing them out
+
+
+class BufferedSink:
+    """
+    Collects output and writes it to a stream in large chunks, so a program
+    that outputs a lot doesn't make a write call for every line.
+
+    Attributes:
+        stream: the text stream to write to, or None for whatever sys.stdout
+        is when the output is written, so redirecting it still works
+        buffer_size (int): how many characters to collect before writing them
+    """
+
+    def __init__(self, stream=None, buffer_size=OUTPUT_BUFFER_SIZE):
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.parts = []
+        self.buffered = 0
+
+    def write(self, text):
+        self.parts.append(text)
+        self.buffered += len(text)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        stream = sys.stdout if self.stream is None else self.stream
+        if self.parts:
+            stream.write("".join(self.parts))
+            self.parts = []
+            self.buffered = 0
+        stream.flush()
+
+    def close(self):
+        self.flush()
+
+
+class FileSink(BufferedSink):
+    """
+    A BufferedSink that writes to a file, which is closed with the sink.
+    """
+
+    def __init__(self, path, buffer_size=OUTPUT_BUFFER_SIZE):
+        super().__init__(open(path, "w", encoding="utf-8"), buffer_size)
+
+    def close(self):
+        self.flush()
+        self.stream.close()
+
+
+class MemorySink:
+    """
+    Keeps all output in memory, for embedding and testing.
+    """
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, text):
+        self.parts.append(text)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def getvalue(self):
+        return "".join(self.parts)
+
+
+output_sink = BufferedSink()
+
+
+def get_output_sink():
+    return output_sink
+
+
+def set_output_sink(sink):
+    """
+    Sets where output(...) writes to. The old sink is flushed first, so
+    nothing written to it is lost.
+
+    Parameters:
+        sink: Any object with write(text), flush() and close() methods.
+
+    Returns:
+        The old sink.
+    """
+
+    global output_sink
+    old_sink = output_sink
+    old_sink.flush()
+    output_sink = sink
+    return old_sink
+
+
+def flush_output():
+    output_sink.flush()
+
+
+# Output still in the buffer when the program ends would be lost otherwise
+atexit.register(flush_output)
@@ -0,0 +1,300 @@
+from tokens import *
+from helper import plural_s
+from error import CodeError
+
+STATEMENT_KINDS = FUNCTION_KINDS | KEYWORD_KINDS | LOOP_KINDS
+CLOSING_KINDS = {
+    DELIMITER_LPAREN: DELIMITER_RPAREN,
+    DELIMITER_LBRACE: DELIMITER_RBRACE,
+}
+
+
+def significant_tokens(tokens):
+    return [token for token in tokens if token.kind not in IGNORE_KINDS]
+
+
+def unclosed_delimiter_error(token):
+    if token.kind == DELIMITER_LPAREN:
+        return CodeError(
+            "Mismatched parentheses: Missing right parenthesis.",
+            error_code=1005,
+            error_token=token,
+        )
+    return CodeError(
+        "Expected '}' to close this '{'",
+        error_code=1008,
+        error_token=token,
+    )
+
+
+def match_delimiters(tokens):
+    """
+    Finds the matching delimiter for every bracket and brace, in one pass.
+
+    Parameters:
+        tokens (list): the tokens to match
+
+    Returns:
+        matches (list): for each token, the index of the delimiter that
+        matches it, or None if it isn't a delimiter
+
+    Raises:
+        CodeError: if the delimiters aren't balanced
+    """
+
+    matches = [None] * len(tokens)
+    open_delimiters = []
+    for i, token in enumerate(tokens):
+        kind = token.kind
+        if kind == DELIMITER_LPAREN or kind == DELIMITER_LBRACE:
+            open_delimiters.append(i)
+        elif kind == DELIMITER_RPAREN or kind == DELIMITER_RBRACE:
+            if not open_delimiters:
+                if kind == DELIMITER_RPAREN:
+                    raise CodeError(
+                        "Mismatched parentheses: Missing left parenthesis.",
+                        error_code=1005,
+                        error_token=token,
+                    )
+                raise CodeError(
+                    f"Unexpected token '{token.content}'",
+                    error_code=1005,
+                    error_token=token,
+                )
+
+            opening = open_delimiters.pop()
+            if CLOSING_KINDS[tokens[opening].kind] != kind:
+                raise unclosed_delimiter_error(tokens[opening])
+
+            matches[opening] = i
+            matches[i] = opening
+
+    if open_delimiters:
+        raise unclosed_delimiter_error(tokens[open_delimiters[-1]])
+
+    return matches
+
+
+def expression_node(expression_tokens):
+    return {
+        "type": "EXPRESSION",
+        "tokens": expression_tokens,
+        "start_position": expression_tokens[0].start_position,
+        "end_position": expression_tokens[-1].end_position,
+    }
+
+
+def parse_parameters(tokens, matches, position, name):
+    # tokens[position] is the '('
+    r_paren_position = matches[position]
+    r_paren_token = tokens[r_paren_position]
+
+    parameters = []
+    parameter_start = position + 1
+    position += 1
+    while position < r_paren_position:
+        kind = tokens[position].kind
+        if kind == DELIMITER_COMMA:
+            parameters.append(tokens[parameter_start:position])
+            parameter_start = position + 1
+        elif kind == DELIMITER_LPAREN:
+            # Commas in brackets belong to the parameter
+            position = matches[position]
+        position += 1
+
+    if parameter_start < r_paren_position:
+        parameters.append(tokens[parameter_start:r_paren_position])
+
+    num_parameters = len(parameters)
+    num_expected_parameters = NUM_EXPECTED_PARAMETERS[name]
+    if num_parameters != num_expected_parameters:
+        if num_parameters > num_expected_parameters:
+            error_token = parameters[num_expected_parameters][0]
+        else:
+            error_token = r_paren_token
+
+        raise CodeError(
+            f"Expected exactly {num_expected_parameters} parameter{plural_s(num_expected_parameters)} for {name.lower()}, not {num_parameters}",
+            error_code=2001,
+            error_token=error_token,
+        )
+
+    for i, parameter in enumerate(parameters):
+        if not parameter:
+            raise CodeError(
+                "Expected expression", error_code=1006, error_token=r_paren_token
+            )
+        parameters[i] = expression_node(parameter)
+
+    return parameters, r_paren_position + 1
+
+
+def parse_function(tokens, matches, position, end):
+    function_token = tokens[position]
+    function_name = function_token.subclass
+    position += 1
+
+    if position >= end or tokens[position].kind != DELIMITER_LPAREN:
+        raise CodeError(
+            f"Expected '(' after {function_name.lower()}",
+            error_code=1002,
+            error_token=tokens[min(position, end - 1)],
+        )
+
+    parameters, position = parse_parameters(tokens, matches, position, function_name)
+
+    if position >= end or tokens[position].kind != DELIMITER_SEMICOLON:
+        raise CodeError(
+            "Expected ';' at the end",
+            error_code=1001,
+            error_token=tokens[position - 1],
+        )
+
+    statement = {
+        "type": function_name,
+        "token": function_token,
+        "parameters": parameters,
+    }
+    return statement, position + 1
+
+
+def parse_keyword(tokens, matches, position, end):
+    keyword_token = tokens[position]
+    keyword_name = keyword_token.subclass
+    position += 1
+
+    keyword_tokens = []
+    while position >= end or tokens[position].kind != DELIMITER_SEMICOLON:
+        if position >= end or tokens[position].kind in STATEMENT_KINDS:
+            raise CodeError(
+                "Expected ';' at the end",
+                error_code=1001,
+                error_token=tokens[position - 1],
+            )
+
+        keyword_tokens.append(tokens[position])
+        position += 1
+
+    if len(keyword_tokens) < MIN_KWD_TOKENS[keyword_name]:
+        raise CodeError(
+            "Unfinished statement", error_code=1009, error_token=tokens[position]
+        )
+
+    if keyword_name == "SET":
+        if keyword_tokens[0].kind != IDENTIFIER_VARIABLE:
+            raise CodeError(
+                "Expected variable name after 'set'",
+                error_code=1004,
+                error_token=keyword_tokens[0],
+            )
+
+        if keyword_tokens[1].kind != OPERATION_EQUALS:
+            raise CodeError(
+                "Expected '=' after variable name",
+                error_code=1004,
+                error_token=keyword_tokens[1],
+            )
+
+        statement = {
+            "type": keyword_name,
+            "token": keyword_token,
+            "variable": keyword_tokens[0],
+            "expression": expression_node(keyword_tokens[2:]),
+        }
+
+    return statement, position + 1
+
+
+def parse_loop(tokens, matches, position, end):
+    loop_token = tokens[position]
+    loop_name = loop_token.subclass
+    position += 1
+
+    if position >= end or tokens[position].kind != DELIMITER_LPAREN:
+        raise CodeError(
+            f"Expected '(' after {loop_name.lower()}",
+            error_code=1002,
+            error_token=tokens[min(position, end - 1)],
+        )
+
+    parameters, position = parse_parameters(tokens, matches, position, loop_name)
+
+    if position >= end or tokens[position].kind != DELIMITER_LBRACE:
+        raise CodeError(
+            "Expected '{' " + f"after {loop_name.lower()}",
+            error_code=1009,
+            error_token=tokens[position - 1],
+        )
+
+    r_brace_position = matches[position]
+    body = parse_block(tokens, matches, position + 1, r_brace_position)
+
+    statement = {
+        "type": loop_name,
+        "token": loop_token,
+        "parameter": parameters[0],
+        "body": body,
+    }
+    return statement, r_brace_position + 1
+
+
+def parse_block(tokens, matches, position, end):
+    """
+    Parses the statements in part of a list of tokens.
+
+    Parameters:
+        tokens (list): the tokens to parse, without any IGNORE tokens
+        matches (list): the matching delimiters from match_delimiters
+        position (int): the index of the first token of the block
+        end (int): the index just after the last token of the block
+
+    Returns:
+        statements (list): the statements in the block
+    """
+
+    statements = []
+    while position < end:
+        token = tokens[position]
+
+        if token.kind in FUNCTION_KINDS:
+            statement, position = parse_function(tokens, matches, position, end)
+        elif token.kind in KEYWORD_KINDS:
+            statement, position = parse_keyword(tokens, matches, position, end)
+        elif token.kind in LOOP_KINDS:
+            statement, position = parse_loop(tokens, matches, position, end)
+        else:
+            raise CodeError(
+                f"Unexpected token '{token.content}'",
+                error_code=1005,
+                error_token=token,
+            )
+
+        statements.append(statement)
+
+    return statements
+
+
+def parse_tokens(tokens):
+    """
+    Parses a list of tokens into a list of statements.
+
+    Statements are dicts with a "type" ("OUTPUT", "SET", "REPEAT" or "WHILE")
+    and the token that started them. Expressions are kept as "EXPRESSION"
+    nodes holding their tokens and source span, and loops hold their body as
+    a nested list of statements, so a program only has to be parsed once no
+    matter how many times its loops run.
+
+    Unbalanced brackets and braces are reported before anything is parsed,
+    and the end of every parameter list and loop body comes from the table
+    built by match_delimiters instead of scanning for it.
+
+    Parameters:
+        tokens (list): the tokens to parse
+
+    Returns:
+        statements (list): the statements of the program
+    """
+
+    tokens = significant_tokens(tokens)
+    matches = match_delimiters(tokens)
+    return parse_block(tokens, matches, 0, len(tokens))
@@ -0,0 +1,144 @@
+PROFILE_KINDS = ["OUTPUT", "SET", "REPEAT", "WHILE condition"]
+
+
+def new_profile():
+    return {}
+
+
+def add_program_profile(profile, program_profile):
+    """
+    Adds the hits and times from one run of a program to a profile, so the
+    profiles of every program in a run can be reported together.
+
+    Parameters:
+        profile (dict): the profile to add to, from new_profile
+        program_profile (dict): the "profile" of a program from
+        bytecode.compile_program
+    """
+
+    for site, hits, time in zip(
+        program_profile["sites"], program_profile["hits"], program_profile["times"]
+    ):
+        key = (site["stack"], site["kind"])
+        if key not in profile:
+            profile[key] = {**site, "hits": 0, "time": 0.0}
+        profile[key]["hits"] += hits
+        profile[key]["time"] += time
+
+
+def total_time(profile):
+    return sum(entry["time"] for entry in profile.values())
+
+
+def line_totals(profile):
+    """
+    Adds up the hits and time of every statement on each line.
+
+    Parameters:
+        profile (dict): the profile
+
+    Returns:
+        lines (list): a dict with "line_number", "hits" and "time" for each
+        line, slowest first
+    """
+
+    lines = {}
+    for entry in profile.values():
+        line_number = entry["line_number"]
+        if line_number not in lines:
+            lines[line_number] = {"line_number": line_number, "hits": 0, "time": 0.0}
+        lines[line_number]["hits"] += entry["hits"]
+        lines[line_number]["time"] += entry["time"]
+    return sorted(lines.values(), key=lambda line: line["time"], reverse=True)
+
+
+def kind_totals(profile):
+    """
+    Adds up the hits and time of every statement of each kind.
+
+    Parameters:
+        profile (dict): the profile
+
+    Returns:
+        kinds (list): a dict with "kind", "hits" and "time" for each of
+        PROFILE_KINDS, slowest first
+    """
+
+    kinds = {kind: {"kind": kind, "hits": 0, "time": 0.0} for kind in PROFILE_KINDS}
+    for entry in profile.values():
+        kinds[entry["kind"]]["hits"] += entry["hits"]
+        kinds[entry["kind"]]["time"] += entry["time"]
+    return sorted(kinds.values(), key=lambda kind: kind["time"], reverse=True)
+
+
+def format_report(profile, lines=(), limit=20):
+    """
+    Makes a table of the slowest lines, and of the time spent on each kind
+    of statement.
+
+    A line's hits are the number of times a statement on it started. The
+    line of a REPEAT is hit once when it starts and every time its counter
+    is checked, and the line of a WHILE every time its condition is checked.
+
+    Parameters:
+        profile (dict): the profile
+        lines (list): the lines of the program, to show next to their times
+        limit (int): the most lines to show, or None for all of them
+
+    Returns:
+        report (str): the report
+    """
+
+    total = total_time(profile)
+
+    def percent(time):
+        return time / total * 100 if total else 0.0
+
+    report = [
+        f"Profile: {total * 1000:.3f} ms",
+        f"{'line':>6} {'hits':>10} {'time ms':>10} {'%':>6}  source",
+    ]
+    for line in line_totals(profile)[:limit]:
+        line_number = line["line_number"]
+        source = lines[line_number - 1].strip() if line_number <= len(lines) else ""
+        report.append(
+            f"{line_number:>6} {line['hits']:>10} {line['time'] * 1000:>10.3f} "
+            f"{percent(line['time']):>6.1f}  {source}"
+        )
+
+    report.append("")
+    report.append(f"{'kind':<16} {'hits':>10} {'time ms':>10} {'%':>6}")
+    for kind in kind_totals(profile):
+        report.append(
+            f"{kind['kind']:<16} {kind['hits']:>10} {kind['time'] * 1000:>10.3f} "
+            f"{percent(kind['time']):>6.1f}"
+        )
+    return "\n".join(report)
+
+
+def collapsed_stacks(profile, root="program"):
+    """
+    Converts a profile to the collapsed stack format read by flamegraph
+    tools: one line per statement, with the loops it is in separated by
+    semicolons and then its time in microseconds.
+
+    Parameters:
+        profile (dict): the profile
+        root (str): the name of the frame at the bottom of every stack
+
+    Returns:
+        lines (list): the lines, without newlines
+    """
+
+    stacks = []
+    for entry in profile.values():
+        microseconds = round(entry["time"] * 1000000)
+        if microseconds:
+            stacks.append(f"{';'.join((root,) + entry['stack'])} {microseconds}")
+    return stacks
+
+
+def write_collapsed_stacks(profile, path, root="program"):
+    with open(path, "w", encoding="utf-8") as file:
+        for line in collapsed_stacks(profile, root):
+            file.write(line + "\n")
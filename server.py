@@ -0,0 +1,332 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from timeit import default_timer
+
+from interpreter import cache_rules, get_worker_interpreter, init_worker
+from output import MemorySink
+from error import CodeError, format_error
+from tokens import RULES_FILE
+
+MAX_REQUEST_SIZE = 64 * 1024 * 1024  # Characters in one request line
+DEFAULT_CODE_FILE = "<request>"
+DEFAULT_TIMEOUT = 10.0  # Seconds a request can run for before its worker is replaced
+
+# Workers are replaced while the server has threads running, which isn't safe
+# to fork from, so they are started by a fork server where there is one
+WORKER_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+def error_details(e):
+    return {
+        "code": e.error_code,
+        "message": str(e),
+        "line": e.line_number,
+        "column": e.relative_start_position + 1,
+        "start_position": e.start_position,
+        "end_position": e.end_position,
+        "display": format_error(e),
+    }
+
+
+def run_request(code, code_file):
+    """
+    Runs the code from one request in a worker. Every run starts with no
+    variables, so requests can't see each other's.
+
+    Parameters:
+        code (str): the program
+        code_file (str): the name to show in error messages
+
+    Returns:
+        response (dict): "success", "output", "error" (None, or the details
+        of the error, with its "code", "message", "line", "column",
+        "start_position", "end_position" and "display"), "variables" and "time"
+    """
+
+    sink = MemorySink()
+    variables = None
+    error = None
+    start_time = default_timer()
+    try:
+        variables = get_worker_interpreter().run_source(
+            code, code_file, output_sink=sink
+        )
+    except CodeError as e:
+        error = error_details(e)
+    except Exception:
+        error = {"code": None, "message": traceback.format_exc()}
+    end_time = default_timer()
+
+    return {
+        "success": error is None,
+        "output": sink.getvalue(),
+        "error": error,
+        "variables": variables,
+        "time": end_time - start_time,
+    }
+
+
+def request_error(message, time=0.0):
+    return {
+        "success": False,
+        "output": "",
+        "error": {"code": None, "message": message},
+        "variables": None,
+        "time": time,
+    }
+
+
+def worker_main(connection, rules_file):
+    # Runs requests sent down the connection until it is closed
+    init_worker(rules_file)
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            break
+        connection.send(run_request(*request))
+
+
+def call_worker(worker, request, timeout):
+    # Waits for the worker in a thread, so the event loop isn't blocked
+    connection = worker["connection"]
+    connection.send(request)
+    if not connection.poll(timeout):
+        raise TimeoutError
+    return connection.recv()
+
+
+class WorkerPool:
+    """
+    Runs requests in worker processes, which each load the rules once and
+    run one request at a time. A worker whose request runs for longer than
+    the timeout is killed and replaced, so a program that never ends only
+    holds up its own request.
+
+    With no worker processes, requests are run in this process one at a
+    time instead, and can't be timed out.
+
+    Attributes:
+        num_workers (int): the number of worker processes
+        rules_file (str): the rules file to tokenise with
+        timeout (float): the seconds a request can run for, or None for no limit
+        idle_workers (asyncio.Queue): the workers waiting for a request
+        workers (list): every worker, each a dict with its "process" and "connection"
+        executor (ThreadPoolExecutor): the threads that wait for workers, or
+        run the requests if there are no workers
+    """
+
+    def __init__(self, num_workers, rules_file, timeout=DEFAULT_TIMEOUT):
+        self.num_workers = num_workers
+        self.rules_file = rules_file
+        self.timeout = timeout
+        self.idle_workers = None
+        self.workers = []
+        if num_workers == 0:
+            # The interpreter isn't thread safe, so only one thread can run code
+            self.executor = ThreadPoolExecutor(
+                max_workers=1, initializer=init_worker, initargs=(rules_file,)
+            )
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=num_workers)
+
+    def start_worker(self):
+        connection, worker_connection = WORKER_CONTEXT.Pipe()
+        process = WORKER_CONTEXT.Process(
+            target=worker_main, args=(worker_connection, self.rules_file), daemon=True
+        )
+        process.start()
+        worker_connection.close()
+        worker = {"process": process, "connection": connection}
+        self.workers.append(worker)
+        return worker
+
+    def stop_worker(self, worker):
+        worker["process"].kill()
+        worker["process"].join()
+        worker["connection"].close()
+        self.workers.remove(worker)
+
+    async def start(self):
+        # Made here, since the queue belongs to the running event loop
+        self.idle_workers = asyncio.Queue()
+        for _ in range(self.num_workers):
+            self.idle_workers.put_nowait(self.start_worker())
+
+    async def run(self, code, code_file):
+        """
+        Runs the code from one request in a worker, waiting for one to be free.
+
+        Parameters:
+            code (str): the program
+            code_file (str): the name to show in error messages
+
+        Returns:
+            response (dict): the response from `run_request`, or an error if
+            the request timed out or its worker stopped
+        """
+
+        loop = asyncio.get_running_loop()
+        if self.num_workers == 0:
+            return await loop.run_in_executor(
+                self.executor, run_request, code, code_file
+            )
+
+        worker = await self.idle_workers.get()
+        try:
+            response = await loop.run_in_executor(
+                self.executor, call_worker, worker, (code, code_file), self.timeout
+            )
+        except TimeoutError:
+            response = request_error(
+                f"Timed out after {self.timeout} seconds", self.timeout
+            )
+        except (EOFError, OSError):
+            response = request_error("The worker running the request stopped")
+        else:
+            self.idle_workers.put_nowait(worker)
+            return response
+
+        # The worker might still be running the request, so it can't be reused
+        self.stop_worker(worker)
+        self.idle_workers.put_nowait(self.start_worker())
+        return response
+
+    def shutdown(self):
+        for worker in list(self.workers):
+            self.stop_worker(worker)
+        self.executor.shutdown(cancel_futures=True)
+
+
+async def handle_request(line, pool):
+    try:
+        request = json.loads(line)
+        code = request["source"]
+        code_file = request.get("file", DEFAULT_CODE_FILE)
+        if not isinstance(code, str) or not isinstance(code_file, str):
+            raise TypeError("'source' and 'file' must be strings")
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        return request_error(f"Invalid request: {e!r}")
+
+    response = await pool.run(code, code_file)
+    if "id" in request:
+        response["id"] = request["id"]
+    return response
+
+
+async def handle_client(reader, writer, pool):
+    # Each line is one JSON request, answered with one JSON line, in order
+    try:
+        while True:
+            try:
+                line = await reader.readline()
+            except ValueError:
+                # The line was longer than MAX_REQUEST_SIZE
+                response = request_error("Request too large")
+                writer.write(json.dumps(response).encode("utf-8") + b"\n")
+                break
+            if not line:
+                break
+
+            response = await handle_request(line, pool)
+            writer.write(json.dumps(response).encode("utf-8") + b"\n")
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(pool, host="127.0.0.1", port=8765, socket_path=None):
+    """
+    Accepts clients until cancelled. Each client can send any number of
+    requests, and clients are served at the same time, with their code run
+    by the pool.
+
+    Parameters:
+        pool (WorkerPool): where to run requests
+        host (str): the address to listen on, if not using a Unix socket
+        port (int): the port to listen on, if not using a Unix socket
+        socket_path (str): the path of a Unix socket to listen on instead
+    """
+
+    await pool.start()
+
+    def client_connected(reader, writer):
+        return handle_client(reader, writer, pool)
+
+    if socket_path:
+        server = await asyncio.start_unix_server(
+            client_connected, socket_path, limit=MAX_REQUEST_SIZE
+        )
+    else:
+        server = await asyncio.start_server(
+            client_connected, host, port, limit=MAX_REQUEST_SIZE
+        )
+
+    addresses = ", ".join(str(sock.getsockname()) for sock in server.sockets)
+    print(f"Serving on {addresses}", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+def make_pool(workers, rules_file, timeout=DEFAULT_TIMEOUT):
+    """
+    Makes the pool that runs requests, with the rules loaded in every worker.
+
+    Parameters:
+        workers (int): the number of worker processes, the number of CPUs if
+        None, or 0 to run every request in this process, one at a time
+        rules_file (str): the rules file to tokenise with
+        timeout (float): the seconds a request can run for, or None for no limit
+
+    Returns:
+        pool (WorkerPool): the pool, started by `serve`
+    """
+
+    cache_rules(rules_file)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    return WorkerPool(workers, rules_file, timeout)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run Prisma programs sent as JSON lines over a socket."
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="the address to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="the port to listen on")
+    parser.add_argument("--socket", help="listen on this Unix socket instead")
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        help="number of worker processes, 0 to run requests in the server process",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=DEFAULT_TIMEOUT,
+        help="seconds a request can run for, 0 for no limit (not used with -j 0)",
+    )
+    parser.add_argument("--rules", default=RULES_FILE, help="the rules file")
+    args = parser.parse_args()
+
+    pool = make_pool(args.workers, args.rules, args.timeout or None)
+    try:
+        asyncio.run(serve(pool, args.host, args.port, args.socket))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+# The modules are at the top of the repository, and load rules.lexif from
+# the working directory, so the tests run from there
+import os
+import sys
+
+ROOT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIRECTORY)
+os.chdir(ROOT_DIRECTORY)
+
+RULES_FILE = os.path.join(ROOT_DIRECTORY, "rules.lexif")
@@ -0,0 +1,203 @@
+import contextlib
+import io
+import operator
+import os
+import shutil
+import tempfile
+import unittest
+
+import context
+
+from interpreter import Interpreter
+from output import MemorySink
+from error import CodeError
+from bytecode import BINARY, LOAD_CONST, compile_program, disassemble, fold_constants
+from lex import tokenise_code
+from parse import parse_tokens
+
+
+class InterpreterTest(unittest.TestCase):
+    def setUp(self):
+        self.interpreter = Interpreter()
+
+    def run_code(self, code):
+        sink = MemorySink()
+        variables = self.interpreter.run_source(code, output_sink=sink)
+        return sink.getvalue(), variables
+
+    def assertOutput(self, code, expected_output):
+        self.assertEqual(self.run_code(code)[0], expected_output)
+
+    def assertErrorCode(self, code, error_code):
+        with self.assertRaises(CodeError) as caught:
+            self.run_code(code)
+        self.assertEqual(caught.exception.error_code, error_code)
+        return caught.exception
+
+    def test_output(self):
+        self.assertOutput('output("hi"); output(\'there\');', "hi\nthere\n")
+        self.assertOutput("output(true); output(2.5);", "true\n2.5\n")
+
+    def test_arithmetic(self):
+        self.assertOutput("output(1 + 2 * 3);", "7\n")
+        self.assertOutput("output((1 + 2) * 3);", "9\n")
+        self.assertOutput("output(2 ^ 10);", "1024\n")
+        self.assertOutput("output(7 % 4);", "3\n")
+        self.assertOutput("output(1 < 2); output(2 <= 1);", "true\nfalse\n")
+
+    def test_and_or(self):
+        self.assertOutput("output(1 and 0); output(0 or 1);", "false\ntrue\n")
+        self.assertOutput("set x = 1; output(x and 0); output(x or 0);", "false\ntrue\n")
+        self.assertOutput("output(0 or 5);", "5\n")
+
+    def test_variables(self):
+        output, variables = self.run_code("set x = 2; set y = x * 3; output(y);")
+        self.assertEqual(output, "6\n")
+        self.assertEqual(variables, {"x": 2, "y": 6})
+
+    def test_runs_start_empty(self):
+        self.run_code("set x = 1;")
+        self.assertErrorCode("output(x);", 2002)
+
+    def test_loops(self):
+        self.assertOutput("repeat (3) { output(1); }", "1\n1\n1\n")
+        self.assertOutput("repeat (0) { output(1); } output(2);", "2\n")
+        self.assertOutput(
+            "set i = 0; while (i < 3) { set i = i + 1; output(i); }", "1\n2\n3\n"
+        )
+        self.assertOutput(
+            "set n = 0; repeat (2) { repeat (3) { set n = n + 1; } } output(n);", "6\n"
+        )
+
+    def test_syntax_errors(self):
+        self.assertErrorCode("output(1) output(2);", 1001)
+        self.assertErrorCode('output("abc);', 1003)
+        self.assertErrorCode("output(1;", 1005)
+        self.assertErrorCode("output(1);}", 1005)
+        self.assertErrorCode("set x 3;", 1009)
+        self.assertErrorCode("repeat (2) output(1);", 1009)
+
+    def test_runtime_errors(self):
+        self.assertErrorCode("output(1, 2);", 2001)
+        self.assertErrorCode("output();", 2001)
+        self.assertErrorCode("output(zz + 1);", 2002)
+        self.assertErrorCode('output("a" + 1);', 2003)
+        self.assertEqual(self.assertErrorCode("output(1 / 0);", 2004).token.content, "/")
+        self.assertErrorCode("set x = 0; output(1 % x);", 2004)
+        self.assertErrorCode("output(2.0 ^ 10000);", 2005)
+        self.assertEqual(self.assertErrorCode('repeat ("a") {}', 2003).token.content, "repeat")
+        self.assertOutput("repeat (0) { output(1 / 0); } output(2);", "2\n")
+
+    def test_output_before_error(self):
+        sink = MemorySink()
+        with self.assertRaises(CodeError):
+            self.interpreter.run_source("output(1); output(zz);", output_sink=sink)
+        self.assertEqual(sink.getvalue(), "1\n")
+
+    def test_expression_values(self):
+        # Every operation needs a value on both sides, and an expression has
+        # to leave exactly one value
+        self.assertErrorCode("output(5 7);", 1006)
+        self.assertErrorCode("output(1 2 +);", 1006)
+        self.assertErrorCode("output(1 +);", 1006)
+        self.assertErrorCode("output(* 2);", 1006)
+        self.assertErrorCode("output(());", 1006)
+        error = self.assertErrorCode("output(12.5 + .5);", 1006)
+        self.assertEqual(error.token.content, ".5")
+        error = self.assertErrorCode("repeat (3) { output(5 7); }", 1006)
+        self.assertEqual(error.token.content, "7")
+
+    def test_unreached_undefined_variable(self):
+        self.assertOutput('repeat (0) { output(z); } output("done");', "done\n")
+        self.assertOutput(
+            'set x = 0; while (x > 0) { output(y); } output("done");', "done\n"
+        )
+        self.assertErrorCode("repeat (2) { output(q); }", 2002)
+
+    def test_undefined_variable_warnings(self):
+        # Reads that can never follow a set are reported without raising,
+        # since they might never run
+        def warnings(code):
+            program = compile_program(parse_tokens(tokenise_code(context.RULES_FILE, code)))
+            return program, [
+                (warning["error_code"], warning["token"].content, warning["token"].line_number)
+                for warning in program["warnings"]
+            ]
+
+        program, found = warnings("set x = 1;\noutput(z + x);")
+        self.assertEqual(found, [(2002, "z", 2)])
+        self.assertIn("WARNING line 2: Variable 'z' is not defined", disassemble(program))
+        self.assertEqual(warnings("repeat (0) { output(z); }")[1], [(2002, "z", 1)])
+        self.assertEqual(warnings("repeat (0) { set z = 1; } output(z);")[1], [])
+        self.assertEqual(warnings("while (x < 3) { set x = 1; }")[1], [])
+        self.assertOutput('repeat (0) { output(z); } output("done");', "done\n")
+
+    def test_power_not_folded_when_huge(self):
+        huge_power = [(LOAD_CONST, 9), (LOAD_CONST, 9 ** 9), (BINARY, operator.pow)]
+        self.assertEqual(fold_constants(huge_power), (huge_power, 0))
+        small_power = [(LOAD_CONST, 2), (LOAD_CONST, 10), (BINARY, operator.pow)]
+        self.assertEqual(fold_constants(small_power), ([(LOAD_CONST, 1024)], 1))
+        self.assertOutput("repeat (0) { set x = 9 ^ 9 ^ 9; } output(2 ^ 100);", f"{2 ** 100}\n")
+
+    def write_code_file(self, code):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        code_path = os.path.join(directory, "code.prsm")
+        with open(code_path, "w", encoding="utf-8") as file:
+            file.write(code)
+        return code_path
+
+    def run_streamed(self, code, output_sink):
+        return self.interpreter.run_file(
+            self.write_code_file(code), stream=True, output_sink=output_sink
+        )
+
+    def test_stream(self):
+        code = "set n = 0;\nrepeat (3) {\n    set n = n + 1;\n    output(n);\n}\noutput(n * 2);\n"
+        sink = MemorySink()
+        variables = self.run_streamed(code, sink)
+        self.assertEqual((sink.getvalue(), variables), self.run_code(code))
+
+    def test_stream_output_before_syntax_error(self):
+        # Each statement runs before the next one is parsed, so its output
+        # is there even though a later statement has a syntax error
+        code = "output(1);\nrepeat (2) { output(2); }\noutput(3) output(4);\n"
+        sink = MemorySink()
+        with self.assertRaises(CodeError) as caught:
+            self.run_streamed(code, sink)
+        self.assertEqual(caught.exception.error_code, 1001)
+        self.assertEqual(caught.exception.line_number, 3)
+        self.assertEqual(sink.getvalue(), "1\n2\n2\n")
+
+        # Buffered output is flushed to stdout before the error gets out
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), self.assertRaises(CodeError):
+            self.run_streamed(code, None)
+        self.assertEqual(output.getvalue(), "1\n2\n2\n")
+
+    def test_interleaved_interpreters(self):
+        # Each interpreter keeps its own code, so an error is shown with the
+        # lines it came from, whatever another interpreter has run since
+        other_interpreter = Interpreter()
+        with self.assertRaises(CodeError) as caught:
+            self.interpreter.run_source("set x = 1;\noutput(y);", "first.prsm")
+        other_interpreter.run_source("output(2);\n" * 3, "second.prsm", MemorySink())
+        error = caught.exception
+        self.assertEqual((error.code_file, error.line), ("first.prsm", "output(y);"))
+        self.assertEqual(self.interpreter.get_lines(), ["set x = 1;", "output(y);"])
+
+        with self.assertRaises(CodeError) as caught:
+            self.run_streamed("output(1);\n\noutput(z);\n", MemorySink())
+        other_interpreter.run_source("output(2);", "second.prsm", MemorySink())
+        error = caught.exception
+        self.assertEqual((error.line_number, error.line), (3, "output(z);"))
+
+    def test_redirect_stdout(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.interpreter.run_source('output("hi");')
+        self.assertEqual(output.getvalue(), "hi\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,292 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from context import RULES_FILE
+
+import lex
+from lex import (
+    EditableCode,
+    load_rules,
+    split_chunks,
+    stitch_chunks,
+    tokenise_chunk,
+    tokenise_code,
+    tokenise_parallel,
+    tokenise_stream,
+    Token,
+)
+
+FRAGMENTS = [
+    "set ", "repeat ", "while ", "output", " ", "\n", "\t", "# comment\n",
+    "=", "+", "-", "*", "/", "^", "%", "<", ">", "!=", "==", "<=", ">=",
+    "and", "or", "1", "23", ".5", "4.25", ".", '"s t"', "'q'", '"', "'",
+    '"multi\nline"', "true", "false", "(", ")", ";", ",", "{", "}",
+    "abc", "x", "settle", "é", "?",
+]
+
+PROGRAM = """set total = 0;
+repeat (10) {
+    set total = total + 1.5 * 2;
+}
+# a comment
+set i = 0;
+while (i < 3 and total >= 30) {
+    set i = i + 1;
+    output("i is " );
+    output(i);
+}
+output('done');
+"""
+
+
+def random_code(random_generator, max_fragments):
+    return "".join(
+        random_generator.choice(FRAGMENTS)
+        for _ in range(random_generator.randint(0, max_fragments))
+    )
+
+
+def token_tuples(tokens):
+    return [
+        (token.kind, token.content, token.start_position, token.end_position, token.line_number)
+        for token in tokens
+    ]
+
+
+class LexerTest(unittest.TestCase):
+    def assertSameTokens(self, tokens, expected_tokens, code):
+        self.assertEqual(token_tuples(tokens), token_tuples(expected_tokens), repr(code))
+
+    def test_compiled_matches_characters(self):
+        random_generator = random.Random(0)
+        codes = [PROGRAM, PROGRAM * 3, ""]
+        codes += [random_code(random_generator, 60) for _ in range(500)]
+        for code in codes:
+            self.assertSameTokens(
+                tokenise_code(RULES_FILE, code, compiled=True),
+                tokenise_code(RULES_FILE, code, compiled=False),
+                code,
+            )
+
+    def test_tokens_cover_code(self):
+        tokens = tokenise_code(RULES_FILE, PROGRAM)
+        self.assertEqual("".join(token.content for token in tokens), PROGRAM)
+        self.assertEqual(tokens[-1].line_number, PROGRAM.count("\n"))
+
+    def test_groups(self):
+        tokens = tokenise_code(RULES_FILE, "a <= b == c")
+        self.assertEqual(
+            [token.content for token in tokens], ["a", " ", "<=", " ", "b", " ", "==", " ", "c"]
+        )
+
+    def test_long_tokens(self):
+        code = f"set {'a' * 100000} = {'7' * 100000};"
+        tokens = tokenise_code(RULES_FILE, code)
+        self.assertEqual([len(token.content) for token in tokens[2:7:4]], [100000, 100000])
+
+
+class GreedyRuleTest(unittest.TestCase):
+    # Rules are added before the VARIABLE rule of rules.lexif, in a rules file
+    # of their own, so its cache doesn't mix with the real one
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def rules_file_with(self, rule):
+        with open(RULES_FILE, "r", encoding="utf-8") as file:
+            rules = file.read()
+        rules = rules.replace(
+            "IDENTIFIER VARIABLE", f"{rule}\nIDENTIFIER VARIABLE", 1
+        )
+        path = os.path.join(self.directory, "rules.lexif")
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(rules)
+        return path
+
+    def assertTokenContents(self, rule, code, expected_contents):
+        rules_file = self.rules_file_with(rule)
+        for compiled in (True, False):
+            tokens = tokenise_code(rules_file, code, compiled)
+            self.assertEqual([token.content for token in tokens], expected_contents)
+
+    def test_longest_alternative(self):
+        self.assertTokenContents("TEST ABC => matches ^(a|abc)$", "abc;", ["abc", ";"])
+
+    def test_lazy_repeat(self):
+        self.assertTokenContents("TEST Q => matches ^q+?$", "qqq;", ["qqq", ";"])
+
+    def test_inner_anchors(self):
+        self.assertTokenContents("TEST ABC => matches ^a$|^abc$", "x abc;", ["x", " ", "abc", ";"])
+        self.assertTokenContents("TEST Z -> matches ^z$|^zzz$", "x zz;", ["x", " ", "z", "z", ";"])
+
+    def test_probed_greedy_regex(self):
+        # Regexes the regex engine can't find the longest match of in one go
+        # are probed at every length instead
+        self.assertTokenContents("TEST X => matches (?i)^x+$", "xXx;", ["xXx", ";"])
+        self.assertTokenContents("TEST AB => matches ^(ab)\\\\1*$", "ababa;", ["abab", "a", ";"])
+        self.assertTokenContents("TEST AB => matches ^ab(?=b)|^abb$", "abb;", ["abb", ";"])
+
+
+class RulesCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.rules_file = os.path.join(self.directory, "rules.lexif")
+        shutil.copyfile(RULES_FILE, self.rules_file)
+
+    def load_again(self):
+        # Forgets the tables loaded by this process, so they come from the cache
+        lex.LOADED_RULES.clear()
+        return load_rules(self.rules_file)
+
+    @unittest.skipUnless(hasattr(os, "getuid"), "the cache needs owners to be checked")
+    def test_second_load_from_cache(self):
+        rule_tables = self.load_again()
+        with mock.patch.object(lex, "build_rule_tables", side_effect=AssertionError):
+            cached_tables = self.load_again()
+        self.assertEqual(cached_tables["kinds"], rule_tables["kinds"])
+        self.assertEqual(
+            token_tuples(tokenise_code(self.rules_file, PROGRAM)),
+            token_tuples(tokenise_code(RULES_FILE, PROGRAM)),
+        )
+
+    @unittest.skipUnless(hasattr(os, "getuid"), "the cache needs owners to be checked")
+    def test_writable_cache_not_loaded(self):
+        self.load_again()
+        cache_directory = os.path.join(self.directory, lex.RULES_CACHE_DIRECTORY)
+        (cache_name,) = os.listdir(cache_directory)
+        os.chmod(os.path.join(cache_directory, cache_name), 0o666)
+        with mock.patch.object(
+            lex, "build_rule_tables", wraps=lex.build_rule_tables
+        ) as build_rule_tables:
+            self.load_again()
+        build_rule_tables.assert_called_once()
+
+    def test_cache_mismatched_kinds(self):
+        # Kinds this process hasn't given out yet have to come next, in order
+        next_kind = len(lex.KINDS)
+        self.assertTrue(lex.cached_kinds_match({("NEW", "KIND"): next_kind}))
+        self.assertFalse(lex.cached_kinds_match({("NEW", "KIND"): next_kind + 1}))
+        self.assertEqual(len(lex.KINDS), next_kind)
+
+
+class StreamTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_streamed_tokens(self):
+        # Tokens that cross a chunk boundary, including strings and groups
+        # split over chunks, come out the same as from the whole code
+        random_generator = random.Random(6)
+        codes = [PROGRAM, 'set s = "a\nb";\nset t = 1 <= 2.25;\n', ""]
+        codes += [random_code(random_generator, 40) for _ in range(50)]
+        code_path = os.path.join(self.directory, "code.prsm")
+        for code in codes:
+            with open(code_path, "w", encoding="utf-8", newline="") as file:
+                file.write(code)
+            for chunk_size in (1, 2, 7, 64, 65536):
+                self.assertEqual(
+                    token_tuples(tokenise_stream(RULES_FILE, code_path, chunk_size)),
+                    token_tuples(tokenise_code(RULES_FILE, code)),
+                    f"{chunk_size} {code!r}",
+                )
+
+
+class EditableCodeTest(unittest.TestCase):
+    def check_random_edits(self, block_size, seed):
+        old_block_size = lex.EDIT_BLOCK_SIZE
+        lex.EDIT_BLOCK_SIZE = block_size
+        self.addCleanup(setattr, lex, "EDIT_BLOCK_SIZE", old_block_size)
+
+        random_generator = random.Random(seed)
+        for _ in range(30):
+            editable_code = EditableCode(RULES_FILE, PROGRAM * random_generator.randint(1, 3))
+            for _ in range(20):
+                code = editable_code.code
+                offset = random_generator.randint(0, len(code))
+                removed_length = random_generator.randint(0, min(6, len(code) - offset))
+                inserted_text = random_code(random_generator, 3)
+                editable_code.edit(offset, removed_length, inserted_text)
+
+                new_code = code[:offset] + inserted_text + code[offset + removed_length :]
+                self.assertEqual(editable_code.code, new_code)
+                self.assertEqual(
+                    token_tuples(editable_code.get_tokens()),
+                    token_tuples(tokenise_code(RULES_FILE, new_code)),
+                    repr(new_code),
+                )
+
+    def test_random_edits(self):
+        for block_size, seed in [(1, 1), (4, 2), (64, 3), (1024, 4)]:
+            self.check_random_edits(block_size, seed)
+
+    def test_edit_from_empty(self):
+        editable_code = EditableCode(RULES_FILE, "")
+        editable_code.edit(0, 0, "set x = 1;")
+        editable_code.edit(4, 1, "yy")
+        self.assertEqual(
+            token_tuples(editable_code.get_tokens()),
+            token_tuples(tokenise_code(RULES_FILE, "set yy = 1;")),
+        )
+        editable_code.edit(0, len(editable_code.code), "")
+        self.assertEqual(editable_code.get_tokens(), [])
+
+    def test_edit_outside_code(self):
+        editable_code = EditableCode(RULES_FILE, "set x = 1;")
+        with self.assertRaises(ValueError):
+            editable_code.edit(5, 10, "")
+
+
+class ChunkTest(unittest.TestCase):
+    def tokenise_chunks(self, code, chunk_size):
+        # The same as tokenise_parallel, without the processes
+        chunk_starts = split_chunks(code, chunk_size)
+        chunk_ends = chunk_starts[1:] + [len(code)]
+        chunks = []
+        line_number = 1
+        for start, end in zip(chunk_starts, chunk_ends):
+            _, kinds, start_positions, end_positions, line_numbers = tokenise_chunk(
+                RULES_FILE, code[start:end], start, line_number
+            )
+            chunks.append(
+                [
+                    Token(kind, code[token_start : token_end + 1], token_start, token_end, token_line)
+                    for kind, token_start, token_end, token_line in zip(
+                        kinds, start_positions, end_positions, line_numbers
+                    )
+                ]
+            )
+            line_number += code.count("\n", start, end)
+        return chunks
+
+    def test_stitch_chunks(self):
+        random_generator = random.Random(5)
+        rule_tables = load_rules(RULES_FILE)
+        codes = [PROGRAM * 5, 'set s = "a\nb\nc\nd";\n' * 20]
+        codes += [random_code(random_generator, 200) for _ in range(40)]
+        for code in codes:
+            for chunk_size in (1, 7, 40, 200):
+                chunks = self.tokenise_chunks(code, chunk_size)
+                self.assertEqual(
+                    token_tuples(stitch_chunks(code, chunks, rule_tables)),
+                    token_tuples(tokenise_code(RULES_FILE, code)),
+                    f"{chunk_size} {code!r}",
+                )
+
+    def test_tokenise_parallel(self):
+        code = PROGRAM * 200
+        self.assertEqual(
+            token_tuples(tokenise_parallel(RULES_FILE, code, workers=2, chunk_size=2000)),
+            token_tuples(tokenise_code(RULES_FILE, code)),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
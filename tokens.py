@@ -1,6 +1,52 @@
-from lex import tokenise
-import re
-from helper import plural_s
+from lex import (
+    KINDS,
+    UNFINISHED_TOKEN,
+    SourceIndex,
+    Token,
+    intern_kind,
+    kinds_of_class,
+    load_rules,
+)
+
+RULES_FILE = "rules.lexif"
+RULE_TABLES = load_rules(RULES_FILE)
+
+# Kinds for each class and subclass, loaded after the rules so they match
+KEYWORD_SET = intern_kind("KEYWORD", "SET")
+LOOP_REPEAT = intern_kind("LOOP", "REPEAT")
+LOOP_WHILE = intern_kind("LOOP", "WHILE")
+FUNCTION_OUTPUT = intern_kind("FUNCTION", "OUTPUT")
+OPERATION_EQUALS = intern_kind("OPERATION", "EQUALS")
+OPERATION_PLUS = intern_kind("OPERATION", "PLUS")
+OPERATION_MINUS = intern_kind("OPERATION", "MINUS")
+OPERATION_TIMES = intern_kind("OPERATION", "TIMES")
+OPERATION_DIVIDE = intern_kind("OPERATION", "DIVIDE")
+OPERATION_POWER = intern_kind("OPERATION", "POWER")
+OPERATION_MODULO = intern_kind("OPERATION", "MODULO")
+OPERATION_LESS_THAN = intern_kind("OPERATION", "LESS_THAN")
+OPERATION_GREATER_THAN = intern_kind("OPERATION", "GREATER_THAN")
+OPERATION_NOT_EQUAL = intern_kind("OPERATION", "NOT_EQUAL")
+OPERATION_AND = intern_kind("OPERATION", "AND")
+OPERATION_OR = intern_kind("OPERATION", "OR")
+OPERATION_LESS_EQUAL = intern_kind("OPERATION", "LESS_EQUAL")
+OPERATION_GREATER_EQUAL = intern_kind("OPERATION", "GREATER_EQUAL")
+OPERATION_EQUAL_TO = intern_kind("OPERATION", "EQUAL_TO")
+LITERAL_NUMBER = intern_kind("LITERAL", "NUMBER")
+LITERAL_STRING = intern_kind("LITERAL", "STRING")
+LITERAL_BOOLEAN = intern_kind("LITERAL", "BOOLEAN")
+DELIMITER_LPAREN = intern_kind("DELIMITER", "LPAREN")
+DELIMITER_RPAREN = intern_kind("DELIMITER", "RPAREN")
+DELIMITER_SEMICOLON = intern_kind("DELIMITER", "SEMICOLON")
+DELIMITER_COMMA = intern_kind("DELIMITER", "COMMA")
+DELIMITER_LBRACE = intern_kind("DELIMITER", "LBRACE")
+DELIMITER_RBRACE = intern_kind("DELIMITER", "RBRACE")
+IDENTIFIER_VARIABLE = intern_kind("IDENTIFIER", "VARIABLE")
+
+IGNORE_KINDS = kinds_of_class("IGNORE")
+FUNCTION_KINDS = kinds_of_class("FUNCTION")
+KEYWORD_KINDS = kinds_of_class("KEYWORD")
+LOOP_KINDS = kinds_of_class("LOOP")
+OPERATION_KINDS = kinds_of_class("OPERATION")
 
 NUM_EXPECTED_PARAMETERS = {
     "OUTPUT": 1,
@@ -10,206 +56,34 @@ NUM_EXPECTED_PARAMETERS = {
 MIN_KWD_TOKENS = {"SET": 3}
 
 CODE_FILE = "code.prsm"
+STREAM_TOKENS = False  # Run each statement as soon as it has been tokenised
 
-tokens = tokenise("rules.lexif", CODE_FILE)
-with open(CODE_FILE, "r") as file:
-    code = file.read()
-    lines = code.split("\n")
-    line_start_positions = [0] + [m.end() for m in re.finditer("\n", code)]
 
-num_tokens = len(tokens)
-token_number = 0
-current_token = tokens[token_number]
+def read_source_index(code_file):
+    with open(code_file, "r") as file:
+        return SourceIndex(file.read())
 
 
-def get_token_number():
-    return token_number
+def get_statements(token_stream):
+    statement_tokens = []
+    brace_depth = 0
+    for token in token_stream:
+        statement_tokens.append(token)
 
+        if token.kind == DELIMITER_LBRACE:
+            brace_depth += 1
+            continue
+        if token.kind == DELIMITER_RBRACE:
+            brace_depth -= 1
+        elif token.kind != DELIMITER_SEMICOLON:
+            continue
 
-def set_token_number(value):
-    global token_number
-    global current_token
-    token_number = value
-    try:
-        current_token = tokens[token_number]
-    except Exception as e:
-        pass
+        if brace_depth <= 0:
+            yield statement_tokens
+            statement_tokens = []
+            brace_depth = 0
 
+    if statement_tokens:
+        yield statement_tokens
 
-def increment_token_number():
-    set_token_number(get_token_number() + 1)
 
-
-def get_current_token():
-    return current_token
-
-
-def get_line_start_positions():
-    return line_start_positions
-
-
-def get_lines():
-    return lines
-
-
-def skip_to_non_ignore():
-    while token_number < num_tokens and tokens[token_number]["class"] == "IGNORE":
-        increment_token_number()
-
-
-def next_non_ignore():
-    increment_token_number()
-    if token_number < num_tokens:
-        skip_to_non_ignore()
-
-
-def find_line_number(position):
-    return len(
-        [
-            line_start_pos
-            for line_start_pos in line_start_positions
-            if line_start_pos <= position
-        ]
-    )
-
-
-def check_token_type(token, token_class, token_subclass):
-    return token["class"] == token_class and token["subclass"] == token_subclass
-
-
-def format_content(token):
-    content = str(token["content"])
-
-    if check_token_type(token, "LITERAL", "STRING"):
-        token["content"] = content
-    elif check_token_type(token, "LITERAL", "NUMBER"):
-        try:
-            token["content"] = int(content)
-        except ValueError:
-            token["content"] = float(content)
-    elif check_token_type(token, "LITERAL", "BOOLEAN"):
-        if content == "true":
-            token["content"] == True
-        if content == "false":
-            token["content"] == False
-
-
-def stringify_content(token):
-    content = token["content"]
-
-    if check_token_type(token, "LITERAL", "STRING"):
-        token["content"] = str(content)
-    elif check_token_type(token, "LITERAL", "NUMBER"):
-        token["content"] = str(content)
-    elif check_token_type(token, "LITERAL", "BOOLEAN"):
-        if content == True:
-            token["content"] = "true"
-        if content == False:
-            token["content"] = "false"
-
-
-from error import CodeError
-
-
-def get_parameters(name):
-    parameters = []
-    current_parameter = []
-    while not check_token_type(get_current_token(), "DELIMITER", "RPAREN"):
-        if check_token_type(get_current_token(), "DELIMITER", "COMMA"):
-            parameters.append(current_parameter)
-            current_parameter = []
-        else:
-            current_parameter.append(get_current_token())
-        next_non_ignore()
-
-        if get_token_number() >= num_tokens:
-            raise CodeError(
-                "Expected ')' at the end",
-                error_code=1006,
-                error_token=current_parameter[-1],
-            )
-
-    if current_parameter:
-        parameters.append(current_parameter)
-
-    num_parameters = len(parameters)
-
-    num_expected_parameters = NUM_EXPECTED_PARAMETERS[name]
-    if num_parameters != num_expected_parameters:
-        if num_parameters == 0:
-            error_token = None
-        else:
-            error_token = parameters[num_expected_parameters][0]
-
-        raise CodeError(
-            f"Expected exactly {num_expected_parameters} parameter{plural_s(num_expected_parameters)} for {name.lower()}, not {num_parameters}",
-            error_code=2001,
-            error_token=error_token,
-        )
-
-    return parameters, num_parameters
-
-
-def get_function_tokens(function_name):
-    l_paren_token = get_current_token()
-    next_non_ignore()
-    parameters, num_parameters = get_parameters(function_name)
-    r_paren_token = get_current_token()
-
-    return l_paren_token, parameters, num_parameters, r_paren_token
-
-
-def get_keyword_tokens(keyword_name):
-    keyword_tokens = []
-    while not check_token_type(get_current_token(), "DELIMITER", "SEMICOLON"):
-        current_token = get_current_token()
-
-        keyword_tokens.append(current_token)
-        if (
-            get_token_number() >= num_tokens
-            or current_token["class"] == "FUNCTION"
-            or current_token["class"] == "KEYWORD"
-            or current_token["class"] == "LOOP"
-        ):
-            raise CodeError(
-                "Expected ';' at the end",
-                error_code=1001,
-                error_token=keyword_tokens[-2],
-            )
-
-        next_non_ignore()
-
-    min_keyword_tokens = MIN_KWD_TOKENS[keyword_name]
-    if len(keyword_tokens) < min_keyword_tokens:
-        raise CodeError("Unfinished statement", error_code=1009)
-
-    return keyword_tokens
-
-
-def get_loop_tokens(loop_name):
-    if not check_token_type(get_current_token(), "DELIMITER", "LPAREN"):
-        raise CodeError(f"Expected '(' after {loop_name.lower()}", error_code=1002)
-    next_non_ignore()
-
-    loop_parameters, num_parameters = get_parameters(loop_name)
-    next_non_ignore()
-
-    if not check_token_type(get_current_token(), "DELIMITER", "LBRACE"):
-        raise CodeError("Expected '{' " + f"after {loop_name.lower()}", error_code=1009)
-    next_non_ignore()
-
-    loop_code = []
-    loop_code_start = get_token_number()
-    while not check_token_type(get_current_token(), "DELIMITER", "RBRACE"):
-        loop_code.append(get_current_token())
-        next_non_ignore()
-
-        if get_token_number() >= num_tokens:
-            raise CodeError(
-                "Expected '}' at the end",
-                error_code=1008,
-                error_token=loop_code[-1],
-            )
-    loop_code_end = get_token_number()
-
-    return loop_parameters, loop_code_start, loop_code, loop_code_end
@@ -0,0 +1,133 @@
+from timeit import default_timer
+from tokens import *
+from helper import UNDEFINED
+from functions import func_output
+from bytecode import *
+from error import CodeError
+
+
+def undefined_variable_error(program, position):
+    token = program["error_tokens"][position]
+    return CodeError(
+        f"Variable '{token.content}' is not defined",
+        error_code=2002,
+        error_token=token,
+    )
+
+
+def string_operand_error(program, position):
+    return CodeError(
+        "Cannot perform arithmetic on STRING",
+        error_code=2003,
+        error_token=program["error_tokens"][position],
+    )
+
+
+def operation_error(program, position, e):
+    # An operation failed on the values it was given
+    if isinstance(e, ZeroDivisionError):
+        message, error_code = "Cannot divide by zero", 2004
+    elif isinstance(e, OverflowError):
+        message, error_code = "Number is too large", 2005
+    else:
+        message, error_code = "Cannot perform arithmetic on STRING", 2003
+    return CodeError(
+        message, error_code=error_code, error_token=program["error_tokens"][position]
+    )
+
+
+def run_bytecode(program, frame):
+    """
+    Runs a program from bytecode.compile_program.
+
+    Parameters:
+        program (dict): the program to run
+        frame (list): the value of each variable slot, UNDEFINED if it hasn't
+        been set, extended for any new slots, and keeping the variables after
+        the program has run
+
+    Raises:
+        CodeError: if the program has an error when it runs
+    """
+
+    code = program["code"]
+    counters = program["counters"]
+    profile = program["profile"]
+    frame.extend([UNDEFINED] * (len(program["slots"]) - len(frame)))
+
+    stack = []
+    push = stack.append
+    pop = stack.pop
+
+    # The profile site that is running, and when it started
+    site = None
+    site_start_time = 0.0
+
+    position = 0
+    num_instructions = len(code)
+    try:
+        while position < num_instructions:
+            opcode, argument = code[position]
+            position += 1
+
+            if opcode == LOAD_CONST:
+                push(argument)
+            elif opcode == LOAD_OPERAND:
+                value = frame[argument]
+                if type(value) is str:
+                    raise string_operand_error(program, position - 1)
+                push(value)
+            elif opcode == BINARY:
+                b = pop()
+                push(argument(pop(), b))
+            elif opcode == STORE_VARIABLE:
+                frame[argument] = pop()
+            elif opcode == JUMP_IF_FALSE:
+                if not pop():
+                    position = argument
+            elif opcode == JUMP:
+                position = argument
+            elif opcode == REPEAT_NEXT:
+                if stack[-1] > 0:
+                    stack[-1] -= 1
+                else:
+                    pop()
+                    position = argument
+            elif opcode == LOAD_VARIABLE:
+                push(frame[argument])
+            elif opcode == LOAD_OPERAND_CHECKED:
+                value = frame[argument]
+                if value is UNDEFINED:
+                    raise undefined_variable_error(program, position - 1)
+                if type(value) is str:
+                    raise string_operand_error(program, position - 1)
+                push(value)
+            elif opcode == LOAD_VARIABLE_CHECKED:
+                value = frame[argument]
+                if value is UNDEFINED:
+                    raise undefined_variable_error(program, position - 1)
+                push(value)
+            elif opcode == REPEAT_SETUP:
+                times = pop()
+                push(int(times) if times >= 1 else 0)
+            elif opcode == OUTPUT:
+                func_output(pop())
+            elif opcode == RAISE:
+                raise argument
+            elif opcode == COUNT:
+                counters[argument] += 1
+            elif opcode == PROFILE:
+                now = default_timer()
+                if site is not None:
+                    profile["times"][site] += now - site_start_time
+                site = argument
+                site_start_time = now
+                profile["hits"][site] += 1
+    except (ZeroDivisionError, OverflowError, TypeError) as e:
+        # Only operations and repeats can fail like this, and they have tokens
+        if position - 1 not in program["error_tokens"]:
+            raise
+        raise operation_error(program, position - 1, e) from None
+    finally:
+        if site is not None:
+            profile["times"][site] += default_timer() - site_start_time